@@ -1,30 +1,123 @@
+"""
+Process the district group and agglomeration sector networks.
+
+The regions are independent from each other, so the per-region stage chains
+are dispatched to a process pool and run concurrently.
+
+:param max-parallel: number of regions processed at the same time\
+    (default ``os.cpu_count() // number of stages``, at least 1)
+:param backend: Louvain implementation of the community detection,\
+    *networkx*, *networkit*, *igraph* or *cugraph*
+"""
 import re
 import os
+import sys
+import shutil
 import subprocess
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-for f in os.listdir("data/group"):
-    g = os.path.basename(str(f))
-    i = re.search("place_connections_2019-09-01_2020-02-29_([a-z_]+)\.csv", g).group(1)
-    print(i)
 
-    cte = f"poetry run python src/convert_to_edgelist.py --input data/group/{g} --output output/network/ --suffix _{i}"
-    subprocess.call(cte, shell=True)
+def resolve_python() -> str:
+    """
+    Resolve the Python interpreter of the Poetry environment.
+
+    It is resolved only once, so the stages are executed by the interpreter\
+    directly, instead of ``poetry run`` resolving the environment for each\
+    of them.
+
+    :return: path of the interpreter, the current one if Poetry is not found
+    """
+    if shutil.which("poetry") is None:
+        return sys.executable
+    return subprocess.check_output(["poetry", "env", "info", "--executable"],
+                                   text=True).strip()
+
+
+def get_stages(g: str, i: str,
+               backend: str = "networkx") -> list[list[str]]:
+    """
+    Build the stage commands of a region.
+
+    :param g: filename of the region's place connections in ``data/group``
+    :param i: region identifier, e.g., *north_buda*
+    :param backend: Louvain implementation of the community detection
+
+    :return: commands as argument lists, in execution order
+    """
+    cte = ["src/convert_to_edgelist.py", "--input", f"data/group/{g}",
+           "--output", "output/network/", "--suffix", f"_{i}"]
+
+    gbt = ["src/generate_beeline_trips.py", "--observed", f"observed_{i}",
+           "--blocks", "data/house_blocks.geojson",
+           "--network-dir", "output/network/"]
+
+    cbc = ["src/calculate_barrier_crossings.py", "--network", f"observed_{i}"]
 
-    gbt = f"poetry run python src/generate_beeline_trips.py --observed observed_{i} --blocks data/house_blocks.geojson --network-dir output/network/"
-    subprocess.call(gbt, shell=True)
+    # amtoem = ["src/add_movements_to_empty_mesh.py",
+    #           "--input", f"data/group/{g}",
+    #           "--observed-trips",
+    #           f"output/trips/network_observed_{i}_beeline.pickle.gz",
+    #           "--output", f"output/mesh_final_{i}.parquet",
+    #           "--observed-barrier-crossing-dir",
+    #           f"output/barrier_crossing/observed_{i}"]
+
+    cd = ["src/place_network_louvain.py", "--observed-network",
+          f"data/group/place_connections_2019-09-01_2020-02-29_{i}.csv",
+          "--block", "data/house_blocks.geojson",
+          "--community-dir", f"place_communities/{i}", "--backend", backend]
+
+    ccc = ["src/calculate_community_crossings.py", "--network", f"observed_{i}",
+           "--communities", f"output/place_communities/{i}/louvain/",
+           "--run-stop", "10"]
+
+    nmor = ["src/null_model_obs_ratio.py",
+            "--barrier-crossing", f"output/barrier_crossing/observed_{i}",
+            "--community-crossing", f"output/community_crossing/observed_{i}",
+            "--output", f"output/obs_ratio/{i}"]
+
+    return [cte, gbt, cbc, cd, ccc, nmor]
+
+
+def run_region(g: str, python: str, backend: str = "networkx") -> str:
+    """
+    Run the stages of a region sequentially.
+
+    :param g: filename of the region's place connections in ``data/group``
+    :param python: path of the Python interpreter running the stages
+    :param backend: Louvain implementation of the community detection
+
+    :return: the region identifier
+
+    :raises subprocess.CalledProcessError: if a stage fails, the remaining\
+        stages of the region are skipped
+    """
+    i = re.search(r"place_connections_2019-09-01_2020-02-29_([a-z_]+)\.csv",
+                  g).group(1)
+    print(i)
+    for stage in get_stages(g, i, backend):
+        subprocess.run([python] + stage, check=True)
+    return i
 
-    cbc = f"poetry run python src/calculate_barrier_crossings.py --network observed_{i}"
-    subprocess.call(cbc, shell=True)
 
-    amtoem = f"poetry run python src/add_movements_to_empty_mesh.py --input data/group/{g} --observed-trips output/trips/network_observed_{i}_beeline.pickle.gz --output output/mesh_final_{i}.csv --observed-barrier-crossing-dir output/barrier_crossing/observed_{i}"
-    # subprocess.call(amtoem, shell=True)
-    # subprocess.call(f"gzip output/mesh_final_{i}.csv", shell=True)
+if __name__ == "__main__":
+    import argparse
 
-    cd = f"poetry run python src/place_network_louvain.py --observed-network data/group/place_connections_2019-09-01_2020-02-29_{i}.csv --block data/house_blocks.geojson --community-dir place_communities/{i}"
-    subprocess.call(cd, shell=True)
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--max-parallel", type=int, required=False,
+        default=max(1, (os.cpu_count() or 1) // len(get_stages("", ""))),
+        help="number of regions processed concurrently")
+    parser.add_argument(
+        "--backend", type=str, required=False, default="networkx",
+        choices=["networkx", "networkit", "igraph", "cugraph"],
+        help="Louvain implementation of the community detection")
+    opts = parser.parse_args()
 
-    ccc = f"poetry run python src/calculate_community_crossings.py --network observed_{i} --communities output/place_communities/{i}/louvain/ --run-stop 10"
-    subprocess.call(ccc, shell=True)
+    regions = [os.path.basename(str(f)) for f in os.listdir("data/group")]
+    python = resolve_python()
 
-    nmor = f"poetry run python src/null_model_obs_ratio.py --barrier-crossing output/barrier_crossing/observed_{i} --community-crossing output/community_crossing/observed_{i} --output output/obs_ratio/{i}"
-    subprocess.call(nmor, shell=True)
+    with ProcessPoolExecutor(max_workers=opts.max_parallel) as ex:
+        futures = {ex.submit(run_region, g, python, opts.backend): g
+                   for g in regions}
+        for future in as_completed(futures):
+            print(f"{future.result()} done")
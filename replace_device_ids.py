@@ -1,9 +1,15 @@
-import pandas as pd
+import os
 import json
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import pyarrow as pa
+import pyarrow.csv as pv
+import pyarrow.compute as pc
 
 with open("input/lookup_initial_stops.json", "r") as fp:
     lookup = json.load(fp)
+lookup_keys = pa.array(list(lookup.keys()))
+lookup_values = pa.array(list(lookup.values()))
 
 inputs = [
     "place_connections_2019-06-01_2019-06-02.csv",
@@ -41,10 +47,46 @@ inputs = [
     "group/place_connections_2019-09-01_2020-02-29_north_western_sector.csv",
 ]
 
-Path("data/group/").mkdir(parents=True, exist_ok=True)
 
-for i in inputs:
-    print(i)
-    data = pd.read_csv(f"input/{i}")
-    data["device_id"] = data["device_id"].map(lookup)
-    data.to_csv(f"data/{i}", index=False)
+def replace(i: str) -> str:
+    """
+    Replace the device IDs of a place connections file.
+
+    The file is read by pyarrow. The device IDs are dictionary encoded, so\
+    only the distinct IDs are looked up among the lookup keys, then the new\
+    IDs are gathered by the dictionary indices. IDs missing from the lookup\
+    become missing.
+
+    The table is written by pandas, so the columns are formatted as before,\
+    e.g., the float block IDs keep their decimal point (*9376.0*) and only\
+    the values with structural characters are quoted.
+
+    :param i: filename relative to the input directory
+
+    :return: the filename
+    """
+    # JSON keys are strings, so the device IDs are read as strings as well
+    data = pv.read_csv(
+        f"input/{i}",
+        convert_options=pv.ConvertOptions(
+            column_types={"device_id": pa.string()})
+    )
+    encoded = data["device_id"].combine_chunks().dictionary_encode()
+    new_ids = pc.take(
+        lookup_values,
+        pc.index_in(encoded.dictionary, value_set=lookup_keys)
+    )
+    data = data.set_column(
+        data.schema.get_field_index("device_id"), "device_id",
+        pc.take(new_ids, encoded.indices)
+    )
+    data.to_pandas().to_csv(f"data/{i}", index=False)
+    return i
+
+
+if __name__ == "__main__":
+    Path("data/group/").mkdir(parents=True, exist_ok=True)
+
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as ex:
+        for i in ex.map(replace, inputs):
+            print(i)
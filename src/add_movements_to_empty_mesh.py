@@ -9,14 +9,59 @@ import logging
 import pandas as pd
 import numpy as np
 import geopandas as gpd
-from sklearn.preprocessing import minmax_scale, StandardScaler
-from sklearn.compose import ColumnTransformer
-from generate_full_mesh import generate, prepare_house_blocks
-from typing import Optional, Literal
+import pyarrow as pa
+import pyarrow.csv as pv
+import pyarrow.parquet as pq
+import shapely
+from pyproj import Transformer
+from generate_full_mesh import generate, prepare_house_blocks, mirror
+from typing import Optional, Literal, Iterator
 
 logger = logging.getLogger("movement to empty mesh")
 logging.basicConfig(stream=sys.stdout, level=logging.INFO)
 
+COUNT_COLUMNS = ["p_i", "p_j", "mob_ij", "primary_count", "secondary_count",
+                 "river_count", "railway_count", "districts_count",
+                 "neighborhoods_count"]
+
+
+def pack_key(df: pd.DataFrame) -> np.ndarray:
+    """
+    Pack the source and target block IDs into a single uint64 key.
+
+    Joins, groupbys and deduplications on the single key hash one column\
+    instead of two. The packed keys keep the (source, target) order.
+
+    :param df: DataFrame with *source* and *target* columns, the IDs are\
+        expected to be non-negative integers that fit into 32 bits.
+
+    :return: array of the packed keys
+
+    ###### Example
+    >>> pack_key(pd.DataFrame({'source': [1, 0], 'target': [2, 1]}))
+    array([4294967298,          1], dtype=uint64)
+    """
+    source = df["source"].to_numpy().astype(np.uint64)
+    target = df["target"].to_numpy().astype(np.uint64)
+    return (source << np.uint64(32)) | target
+
+
+def unpack_key(key: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Unpack the keys created by :py:func:`pack_key`.
+
+    :param key: array of packed keys
+
+    :return: source and target block IDs as int64 arrays
+
+    ###### Example
+    >>> unpack_key(np.array([4294967298, 1], dtype=np.uint64))
+    (array([1, 0]), array([2, 1]))
+    """
+    key = np.asarray(key, dtype=np.uint64)
+    return ((key >> np.uint64(32)).astype(np.int64),
+            (key & np.uint64(0xFFFFFFFF)).astype(np.int64))
+
 
 def get_mobility(df: pd.DataFrame) -> pd.DataFrame:
     """
@@ -38,9 +83,10 @@ def get_mobility(df: pd.DataFrame) -> pd.DataFrame:
     0       1       2       2
     1       1       3       1
     """
-    mob = df.groupby(["source", "target"])["weight"].sum().reset_index()
-    mob.columns = ["source", "target", "mob_ij"]
-    return mob
+    mob = df["weight"].groupby(pack_key(df)).sum()
+    source, target = unpack_key(mob.index)
+    return pd.DataFrame({"source": source, "target": target,
+                         "mob_ij": mob.to_numpy()})
 
 
 def get_pi_pj(df: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
@@ -95,32 +141,53 @@ def get_movement_data(
     data = distances.merge(pi.rename({"count": "pi"}, axis=1), on="source")\
                     .merge(pj.rename({"count": "pj"}, axis=1), on="target")
     data.columns = ["source", "target", "distance_ij", "p_i", "p_j"]
-    data = data.query("distance_ij > 0").reset_index(drop=True).copy()
+    data = data.query("distance_ij > 0").reset_index(drop=True)
 
     mob = get_mobility(df)
-    data = data.merge(mob, on=["source", "target"], how="left")
+    # left merge on the packed key
+    data["mob_ij"] = pd.Series(mob["mob_ij"].to_numpy(), index=pack_key(mob))\
+        .reindex(pack_key(data)).to_numpy()
     return data
 
 
+def read_edges(path: str) -> pd.DataFrame:
+    """
+    Read an edge CSV with pyarrow-backed dtypes.
+
+    The block IDs are downcast to numpy int32 already at reading, as they are\
+    the keys of the joins, the other columns keep the pyarrow dtypes.
+
+    :param path: path of a CSV with *source* and *target* columns
+
+    :return: the edges in Pandas DataFrame
+    """
+    return pd.read_csv(path, engine="pyarrow", dtype_backend="pyarrow",
+                       dtype={"source": "int32", "target": "int32"})
+
+
 def get_empty_mesh(hb: gpd.GeoDataFrame, mesh_dir: str) -> pd.DataFrame:
     """
     Read empty mesh dataframe or generate if not exists.
 
+    The Parquet mesh is preferred, the CSV (or gzipped CSV) mesh generated\
+    by earlier versions is read if only that exists.
+
     :param hb: blocks in GeoPandas GeoDataFrame format.
-    - It is only used if the mesh.csv is not exist.
-    :param mesh_dir: directory where the mesh.csv is.
+    - It is only used if the mesh is not exist.
+    :param mesh_dir: directory where the mesh.parquet or mesh.csv is.
 
     :return: the empty mesh in Pandas DataFrame.
     """
-    filename = f"{mesh_dir}/mesh.csv"
-    ungzipped_exist = os.path.exists(filename)
-    gzipped_exist = os.path.exists(f"{filename}.gz")
-    if not ungzipped_exist and not gzipped_exist:
-        # runs 24m
+    filename = f"{mesh_dir}/mesh.parquet"
+    if not os.path.exists(filename):
+        for csv in [f"{mesh_dir}/mesh.csv", f"{mesh_dir}/mesh.csv.gz"]:
+            if os.path.exists(csv):
+                return read_edges(csv)
         generate(filename, hb)
-    elif gzipped_exist:
-        filename += ".gz"
-    return pd.read_csv(filename, engine="pyarrow")
+    table = pq.read_table(filename)
+    if (table.schema.metadata or {}).get(b"symmetric") == b"true":
+        return mirror(table.to_pandas())
+    return table.to_pandas()
 
 
 def update_full_mesh_with_movements(
@@ -131,19 +198,20 @@ def update_full_mesh_with_movements(
 
     :param empty_mesh: DataFrame containing the empty mesh
     :param data: DataFrame that contains movement edges
-    - output of :py:func:`get_movement_data`
+    - output of :py:func:`get_movement_data`, unique (source, target) pairs
     :param output:
 
     :return: full mesh with movements edges, contains NAs
     """
     try:
-        mesh = pd.read_csv(f"{output}/mesh_updated.csv", engine="pyarrow")
+        mesh = read_edges(f"{output}/mesh_updated.csv")
     except FileNotFoundError:
         logger.info(f"{output}/mesh_updated.csv was not found. Generating it.")
         # 10m
-        mesh = pd.concat([empty_mesh, data])
-        mesh.drop_duplicates(subset=["source", "target"], keep="last",
-                             inplace=True)
+        # the empty edges that have movements are replaced by the movement
+        # edges, only the keys of the movement data are hashed
+        replaced = pd.Index(pack_key(data)).get_indexer(pack_key(empty_mesh))
+        mesh = pd.concat([empty_mesh[replaced < 0], data], ignore_index=True)
         mesh.to_csv(f"{output}/mesh_updated.csv", index=False)
     return mesh
 
@@ -158,49 +226,93 @@ def load_barrier_crossings(bc_path: str) -> tuple[pd.DataFrame, pd.DataFrame,
 
     :return: six DataFrames for the six different kind of barriers.
     """
-    bc_road2 = pd.read_csv(f"{bc_path}/road2.csv.gz", engine="pyarrow")
+    bc_road2 = read_edges(f"{bc_path}/road2.csv.gz")
     bc_road2.columns = ["source", "target", "secondary_count"]
 
-    bc_road1 = pd.read_csv(f"{bc_path}/road1.csv.gz", engine="pyarrow")
+    bc_road1 = read_edges(f"{bc_path}/road1.csv.gz")
     bc_road1.columns = ["source", "target", "primary_count"]
 
-    bc_river = pd.read_csv(f"{bc_path}/river.csv.gz", engine="pyarrow")
+    bc_river = read_edges(f"{bc_path}/river.csv.gz")
     bc_river.columns = ["source", "target", "river_count"]
 
-    bc_railways = pd.read_csv(f"{bc_path}/railways.csv.gz", engine="pyarrow")
+    bc_railways = read_edges(f"{bc_path}/railways.csv.gz")
     bc_railways.columns = ["source", "target", "railway_count"]
 
-    bc_districts = pd.read_csv(f"{bc_path}/districts.csv.gz", engine="pyarrow")
+    bc_districts = read_edges(f"{bc_path}/districts.csv.gz")
     bc_districts.columns = ["source", "target", "districts_count"]
 
-    bc_adm10 = pd.read_csv(f"{bc_path}/neighborhoods.csv.gz", engine="pyarrow")
+    bc_adm10 = read_edges(f"{bc_path}/neighborhoods.csv.gz")
     bc_adm10.columns = ["source", "target", "neighborhoods_count"]
 
     return bc_road1, bc_road2, bc_river, bc_railways, bc_districts, bc_adm10
 
 
+def merge_barrier_crossings(*bcs: pd.DataFrame) -> pd.DataFrame:
+    """
+    Merge the barrier crossing DataFrames into a single one.
+
+    All the DataFrames are indexed by the (source, target) pairs and\
+    concatenated column-wise in one step, instead of chained merges.
+    Every pair that crosses any of the barriers is kept, the counts of the\
+    barriers that the pair does not cross are missing.
+
+    :param bcs: barrier crossing DataFrames with the columns of *source*,\
+        *target* and a count column
+    - loaded by :py:func:`load_barrier_crossings`
+
+    :return: DataFrame with the *source*, *target* and the count columns
+
+    ###### Example
+    >>> bc_river = pd.DataFrame({'source': [1, 2], 'target': [2, 3],\
+                                 'river_count': [1, 1]})
+    >>> bc_road1 = pd.DataFrame({'source': [1, 4], 'target': [2, 5],\
+                                 'primary_count': [2, 3]})
+    >>> merge_barrier_crossings(bc_river, bc_road1)
+    ... # doctest: +NORMALIZE_WHITESPACE
+       source  target  river_count  primary_count
+    0       1       2          1.0            2.0
+    1       2       3          1.0            NaN
+    2       4       5          NaN            3.0
+    """
+    return pd.concat(
+        [bc.set_index(["source", "target"]) for bc in bcs],
+        axis=1, join="outer"
+    ).reset_index()
+
+
 def generate_distances(trips_path: str) -> pd.DataFrame:
     """
     Generate distances DataFrame.
 
     The method reprojects the geometry to a meter-unit projection, EPSG:23700\
     as the study works with Hungarian data.
-    Distance is in meter.
+    Distance is in meter, rounded to integer.
+
+    As the trips are beelines, only their endpoints are reprojected and the\
+    distance is the euclidean distance of the projected endpoints.
 
     :param trips_path: path to trips shapefile.
 
     :return: DataFrame with three columns (source, target, distance)
     """
     trips = pd.read_pickle(trips_path)
-    trips = gpd.GeoDataFrame(trips, geometry="geometry", crs=4326)
-    trips.to_crs(23700, inplace=True)
-    trips["distance"] = trips.geometry.length
-    trips["distance"] = trips["distance"].apply(np.round)
-    distances = trips[["source", "target", "distance"]].copy()
+    geometry = np.asarray(trips["geometry"].values)
+    start = shapely.get_point(geometry, 0)
+    end = shapely.get_point(geometry, -1)
+
+    transformer = Transformer.from_crs(4326, 23700, always_xy=True)
+    x0, y0 = transformer.transform(shapely.get_x(start), shapely.get_y(start))
+    x1, y1 = transformer.transform(shapely.get_x(end), shapely.get_y(end))
+
+    distances = trips[["source", "target"]].copy()
+    distances["distance"] = np.round(np.hypot(x1 - x0, y1 - y0))\
+        .astype(np.int32)
     return distances
 
 
-def add_one_to_prevent_log_zero(df: pd.DataFrame) -> pd.DataFrame:
+def add_one_to_prevent_log_zero(
+    df: pd.DataFrame, copy: bool = False
+) -> pd.DataFrame:
     """
     Increase the zero values with one to prevent log(0).
 
@@ -216,6 +328,7 @@ def add_one_to_prevent_log_zero(df: pd.DataFrame) -> pd.DataFrame:
     - neighborhoods_count
 
     :param df: import DataFrame with the previous column.
+    :param copy: if False, the input DataFrame is updated in place
 
     :return: DataFrame in which the values are increased by one.
 
@@ -223,23 +336,22 @@ def add_one_to_prevent_log_zero(df: pd.DataFrame) -> pd.DataFrame:
                            'primary_count': [0], 'secondary_count': [0],\
                            'river_count': [0], 'railway_count': [0],\
                            'districts_count': [0], 'neighborhoods_count': [0]})
-    >>> df.iloc[0].sum()
+    >>> int(df.iloc[0].sum())
     0
     >>> df2 = add_one_to_prevent_log_zero(df)
-    >>> df2.iloc[0].sum()
+    >>> int(df2.iloc[0].sum())
     9
     """
-    temp = df.copy()
-    for i in ["p_i", "p_j", "mob_ij", "primary_count", "secondary_count",
-              "river_count", "railway_count", "districts_count",
-              "neighborhoods_count"]:
-        temp[i] = temp[i] + 1
+    temp = df.copy() if copy else df
+    # a single block-wise add instead of one new Series per column
+    temp[COUNT_COLUMNS] = temp[COUNT_COLUMNS] + 1
     return temp
 
 
 def take_logarithm(
     df: pd.DataFrame,
-    transform: Optional[Literal["minmax_scale", "standard_scale"]] = None
+    transform: Optional[Literal["minmax_scale", "standard_scale"]] = None,
+    copy: bool = False
 ) -> pd.DataFrame:
     """
     Take the logarithm of the values before appling the OLS model.
@@ -263,6 +375,8 @@ def take_logarithm(
     - neighborhoods_count
 
     :param df: import DataFrame with the previous column.
+    :param transform: optional scaling applied after the logarithm
+    :param copy: if False, the input DataFrame is updated in place
 
     :return: DataFrame in which the logarithm of the values may be transformed.
     >>> data = [1, 2, 4, 0, 2, 3, 6, 1, 0, 2, 5, 4, 3, 6, 2, 1, 2, 2, 3, 3, 2]
@@ -278,18 +392,20 @@ def take_logarithm(
      0.450819,  1.533185, -0.105594, -0.889814, -0.105594, -0.105594,\
      0.450819,  0.450819, -0.105594]
     """
-    temp = df.copy()
-    for i in ["p_i", "p_j", "mob_ij", "primary_count", "secondary_count",
-              "river_count", "railway_count", "districts_count",
-              "neighborhoods_count"]:
-        log_ = np.log(temp[i] + 1)
-        if transform == "minmax_scale":
-            temp[i] = minmax_scale(log_)
-        elif transform == "standard_scale":
-            scaler = StandardScaler()
-            temp[i] = scaler.fit_transform(np.reshape(log_, (-1, 1)))
-        elif transform is None:
-            temp[i] = log_
+    temp = df.copy() if copy else df
+    # all the columns are transformed at once on a (N x 9) matrix
+    arr = np.log1p(temp[COUNT_COLUMNS].to_numpy(dtype=np.float64))
+    if transform == "minmax_scale":
+        arr -= arr.min(axis=0)
+        range_ = arr.max(axis=0)
+        # constant columns are left zero, as minmax_scale does
+        arr /= np.where(range_ == 0, 1, range_)
+    elif transform == "standard_scale":
+        arr -= arr.mean(axis=0)
+        std = arr.std(axis=0)
+        # constant columns are left zero, as StandardScaler does
+        arr /= np.where(std == 0, 1, std)
+    temp[COUNT_COLUMNS] = arr
     return temp
 
 
@@ -320,12 +436,121 @@ def update_empty_mesh_with_movements_brute_force(
     mesh.to_csv(f"{output}/mesh_final.csv.gz", index=False)
 
 
+def read_mesh_chunks(mesh: str, block_size: int = 128 << 20,
+                     target_bytes: int = 512 << 20,
+                     min_rows: int = 1_000_000,
+                     symmetric: Optional[bool] = None
+                     ) -> Iterator[pd.DataFrame]:
+    """
+    Read the mesh in chunks.
+
+    An uncompressed file is memory mapped, a compressed CSV (e.g.,\
+    *mesh.csv.gz*) is decompressed by an input stream. A CSV mesh is parsed\
+    by the streaming CSV reader of pyarrow in blocks of *block_size* bytes,\
+    a Parquet mesh (see :py:func:`generate_full_mesh.generate`) is read in\
+    record batches. The chunk size is derived from the first batch: as many\
+    rows as fit into *target_bytes*, but at least *min_rows*, so the\
+    per-chunk overhead is amortized on large meshes.
+
+    :param mesh: path of the mesh CSV, compressed CSV (detected by the\
+        extension) or Parquet file (*.parquet* extension)
+    :param block_size: size of the parsed CSV blocks in bytes
+    :param target_bytes: approximate memory size of a chunk in bytes
+    :param min_rows: lower bound of the chunk size in rows
+    :param symmetric: if True, the mesh contains only one orientation of the\
+        pairs (see :py:func:`generate_full_mesh.generate`) and the reverse\
+        pairs are added to every chunk. If None, it is read from the schema\
+        metadata of a Parquet mesh.
+
+    :return: iterator of the chunks, all but the last one have the same\
+        number of (written) rows
+    """
+    if mesh.endswith(".parquet"):
+        parquet = pq.ParquetFile(pa.memory_map(mesh))
+        reader, schema = parquet.iter_batches(), parquet.schema_arrow
+        if symmetric is None:
+            symmetric = (schema.metadata or {}).get(b"symmetric") == b"true"
+    else:
+        # the compression is detected by the extension, only an uncompressed
+        # file can be parsed from the memory map
+        stream = pa.input_stream(mesh, compression="detect")
+        if isinstance(stream, pa.CompressedInputStream):
+            source = stream
+        else:
+            stream.close()
+            source = pa.memory_map(mesh)
+        reader = pv.open_csv(
+            source,
+            read_options=pv.ReadOptions(block_size=block_size),
+            convert_options=pv.ConvertOptions(column_types={
+                "source": pa.int64(), "target": pa.int64(),
+                "distance_ij": pa.float64()})
+        )
+        schema = reader.schema
+    rows, batches, buffered = None, [], 0
+    for batch in reader:
+        if batch.num_rows == 0:
+            continue
+        if rows is None:
+            row_bytes = max(1, batch.nbytes // batch.num_rows)
+            rows = max(min_rows, target_bytes // row_bytes)
+        batches.append(batch)
+        buffered += batch.num_rows
+        if buffered < rows:
+            continue
+        table = pa.Table.from_batches(batches)
+        offset = 0
+        while buffered - offset >= rows:
+            chunk = table.slice(offset, rows).to_pandas()
+            yield mirror(chunk) if symmetric else chunk
+            offset += rows
+        batches = table.slice(offset).to_batches()
+        buffered -= offset
+    if buffered:
+        chunk = pa.Table.from_batches(batches, schema).to_pandas()
+        yield mirror(chunk) if symmetric else chunk
+
+
+def mesh_table(df: pd.DataFrame,
+               schema: Optional[pa.Schema] = None) -> pa.Table:
+    """
+    Build an Arrow table from a mesh chunk.
+
+    The table is assembled from the numpy arrays of the columns, so the\
+    pandas conversion layer (index, metadata, per column type inference) is\
+    skipped. The block IDs are stored as int32, all other columns as float64.
+
+    :param df: mesh chunk
+    :param schema: schema of the table, derived from the columns if None
+
+    :return: the chunk as Arrow table
+
+    ###### Example
+    >>> mesh_table(pd.DataFrame({'source': [1], 'target': [2], \
+'mob_ij': [0.5]})).schema
+    source: int32
+    target: int32
+    mob_ij: double
+    """
+    if schema is None:
+        schema = pa.schema([
+            (c, pa.int32() if c in ("source", "target") else pa.float64())
+            for c in df.columns])
+    return pa.table({
+        field.name: df[field.name].to_numpy(
+            dtype=field.type.to_pandas_dtype())
+        for field in schema
+    }, schema=schema)
+
+
 def update_empty_mesh_with_movements_stream(
     data: pd.DataFrame, pre: pd.DataFrame,
     mesh: str,
     output: str,
     keep_self_loops: bool = True,
-    transform: Optional[Literal["minmax_scale", "standard_scale"]] = None
+    transform: Optional[Literal["minmax_scale", "standard_scale"]] = None,
+    output_format: Literal["parquet", "csv"] = "parquet",
+    **chunk_options
 ) -> None:
     """
     Update empty mesh with movements, using stream processing.
@@ -341,36 +566,63 @@ def update_empty_mesh_with_movements_stream(
     :param data: movement data
     - loaded by :py:func:`get_movement_data`
     :param pre: merged barrier crossing data
-    :param output: directory where to save the output
+    :param output: path of the output file
     :param normalize_also: if True, the count columns are also normalized\
         using MinMax scaling
     :param keep_self_loops: if True, edges with the same source and target\
         nodes are kept in the dataframe
-    """
-    with pd.read_csv(mesh, chunksize=1_000_000) as reader:
-        for k, chunk in enumerate(reader):
-            logger.info(f"heartbeat: {k}")
-
-            # data_chunk based on: https://stackoverflow.com/a/33282617/4737417
-            idx_chunk = chunk.set_index(["source", "target"]).index
-            idx_data = data.set_index(["source", "target"]).index
-            data_chunk = data[idx_data.isin(idx_chunk)].copy()
-
-            temp = pd.concat([chunk, data_chunk])
-            temp.drop_duplicates(subset=["source", "target"], keep="last",
-                                 inplace=True)
-
-            temp = temp.merge(pre, on=["source", "target"], how="left")
-            temp.fillna(0, inplace=True)
-
-            temp = take_logarithm(temp, transform=transform)
-
-            if not keep_self_loops:
-                temp = remove_self_loops(temp)
+    :param output_format: *parquet* writes the chunks as row groups of a\
+        zstd compressed Parquet file, *csv* appends them to a CSV file
+    :param chunk_options: passed to :py:func:`read_mesh_chunks`
 
+    .. note::
+        A symmetric mesh (see :py:func:`generate_full_mesh.generate`) is\
+        read in both orientations, but it has no self pairs, so the output\
+        has no self loops regardless of *keep_self_loops*.
+    """
+    # the index of the movement data is built only once, the chunks probe it
+    key_data = pack_key(data)
+    unique = ~pd.Index(key_data).duplicated(keep="last")
+    data, idx_data = data[unique], pd.Index(key_data[unique])
+    # same for the barrier crossings, instead of a merge per chunk
+    pre_indexed = pre.drop(["source", "target"], axis=1)\
+        .set_index(pd.Index(pack_key(pre)))
+    writer = None
+    for k, chunk in enumerate(read_mesh_chunks(mesh, **chunk_options)):
+        logger.info(f"heartbeat: {k}")
+
+        key_chunk = pack_key(chunk)
+        indexer = idx_data.get_indexer(key_chunk)
+        matched = np.sort(indexer[indexer >= 0])
+        data_chunk = data.iloc[matched]
+
+        temp = pd.concat([chunk, data_chunk])
+        key_temp = np.concatenate([key_chunk, idx_data.values[matched]])
+        unique = ~pd.Index(key_temp).duplicated(keep="last")
+        temp, key_temp = temp[unique], key_temp[unique]
+
+        temp[list(pre_indexed.columns)] = pre_indexed.reindex(key_temp)\
+            .to_numpy(dtype=np.float64, na_value=np.nan)
+        temp.fillna(0, inplace=True)
+
+        temp = take_logarithm(temp, transform=transform)
+
+        if not keep_self_loops:
+            temp = remove_self_loops(temp)
+
+        if output_format == "parquet":
+            # the schema of the first chunk is kept for the whole file
+            table = mesh_table(temp, writer.schema if writer else None)
+            if writer is None:
+                writer = pq.ParquetWriter(output, table.schema,
+                                          compression="zstd")
+            writer.write_table(table)
+        else:
             # header inspiration: https://stackoverflow.com/a/17975690/4737417
             temp.to_csv(output, index=False, mode="a",
                         header=not os.path.exists(output))
+    if writer:
+        writer.close()
 
 
 def remove_self_loops(df: pd.DataFrame) -> pd.DataFrame:
@@ -396,8 +648,8 @@ if __name__ == "__main__":
         "--mesh",
         type=str,
         required=False,
-        default="output/mesh.csv",
-        help="empty mesh")
+        default="output/mesh.parquet",
+        help="empty mesh, Parquet or CSV")
     parser.add_argument(
         "--blocks",
         type=str,
@@ -425,26 +677,32 @@ if __name__ == "__main__":
         "--output",
         type=str,
         required=False,
-        default="output/mesh_final.csv",
+        default="output/mesh_final.parquet",
         help="result filename")
+    parser.add_argument(
+        "--output-format",
+        type=str,
+        required=False,
+        default="parquet",
+        choices=["parquet", "csv"],
+        help="format of the result file")
     opts = parser.parse_args()
 
     distances = generate_distances(opts.observed_trips)
 
     hb = prepare_house_blocks(opts.blocks)
 
-    df = pd.read_csv(opts.input)
+    df = pd.read_csv(opts.input, engine="pyarrow", dtype_backend="pyarrow")
+    # block IDs are stored as floats in the place connections
+    df = df.astype({"source": "int32", "target": "int32"})
     data = get_movement_data(df, distances)
 
     logger.info("load barrier crossings")
     bc_road1, bc_road2, bc_river, bc_railways, bc_districts, \
         bc_adm10 = load_barrier_crossings(opts.observed_barrier_crossing_dir)
 
-    pre = bc_river.merge(bc_road1, on=["source", "target"], how="left")\
-                  .merge(bc_road2, on=["source", "target"], how="left")\
-                  .merge(bc_railways, on=["source", "target"], how="left")\
-                  .merge(bc_districts, on=["source", "target"], how="left")\
-                  .merge(bc_adm10, on=["source", "target"], how="left")
+    pre = merge_barrier_crossings(bc_river, bc_road1, bc_road2, bc_railways,
+                                  bc_districts, bc_adm10)
 
     # required for brute force version
     # logger.info("load empty mesh")
@@ -452,4 +710,5 @@ if __name__ == "__main__":
     logger.info("update mesh")
     update_empty_mesh_with_movements_stream(
         data, pre, opts.mesh,
-        output=opts.output, transform=opts.transform)
+        output=opts.output, transform=opts.transform,
+        output_format=opts.output_format)
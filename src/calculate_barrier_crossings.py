@@ -14,22 +14,122 @@ Script to calculate barrier crossings.
     - *neighborhhods*: OSM admin level 10
 :param multithreading: if set, calculation for all the barriers types are\
     started on separate threads
+:param chunks [int]: if set, the trips are split into chunks that are\
+    processed in parallel for each barrier type (takes precedence over\
+    *multithreading*)
 :param output [str]: output directory (default ``output/barrier_crossing``)
 """
 import pathlib
 import pandas as pd
+import numpy as np
 from os.path import exists
-from typing import Literal
-from multiprocessing import Pool
+from typing import Literal, Optional
+from functools import partial
+from multiprocessing import Pool, get_context, cpu_count
+from multiprocessing.pool import Pool as PoolType
 import geopandas as gpd
+import shapely
 from itertools import repeat
 
 
+def index_barrier(barrier: gpd.GeoDataFrame, column: str) -> dict:
+    """
+    Create a barrier entry for the barrier types dictionary.
+
+    Besides the data and the ID column, the entry caches the STRtree of the\
+    barrier geometries, the prepared geometries and the barrier IDs, so the\
+    spatial index is built only once, not for every crossing calculation.
+
+    :param barrier: barrier geometries in GeoPandas GeoDataFrame format
+    :param column: ID column of the barriers
+    - *index_right* refers to the index of the barriers, as in sjoin
+
+    :return: dictionary with the *data*, *column*, *tree*, *geoms* and *ids*\
+        keys
+    """
+    ids = barrier.index.values if column == "index_right" \
+        else barrier[column].values
+    geoms = np.asarray(barrier.geometry.values)
+    shapely.prepare(geoms)
+    return {
+        "data": barrier,
+        "column": column,
+        "tree": shapely.STRtree(geoms),
+        "geoms": geoms,
+        "ids": ids
+    }
+
+
+def find_crossing_pairs(
+    barrier_type: Literal["road1", "road2", "railways", "river", "districts",
+                          "neighborhoods"],
+    barrier_types: dict, trips: gpd.GeoDataFrame
+) -> pd.DataFrame:
+    """
+    Find the intersecting trip-barrier pairs.
+
+    The candidate pairs are queried from the STRtree of the barriers, so the\
+    full spatial join table is never materialized. The candidates are then\
+    tested with the prepared barrier geometries, which reuse their internal\
+    index across the trips. The entry cached by :py:func:`index_barrier` is\
+    used if present, otherwise it is built.
+
+    :param barrier_type: barrier type, key of the *barrier_types*
+    :param barrier_types: a dictionary containing infor to handle barriers
+    :param trips: beeline trips as LineStrings in GeoPandas GeoDataFrame format
+
+    :return: DataFrame with three columns: *source*, *target* and the ID\
+        column of the barrier, one row per intersecting pair
+    """
+    bt = barrier_types[barrier_type]
+    if "tree" not in bt:
+        bt = index_barrier(bt["data"], bt["column"])
+
+    trip_geoms = np.asarray(trips.geometry.values)
+    trip_idx, barrier_idx = bt["tree"].query(trip_geoms)
+    # the first argument is prepared, so its cached index is used
+    hit = shapely.intersects(bt["geoms"][barrier_idx], trip_geoms[trip_idx])
+    trip_idx, barrier_idx = trip_idx[hit], barrier_idx[hit]
+
+    return pd.DataFrame({
+        "source": trips["source"].values[trip_idx],
+        "target": trips["target"].values[trip_idx],
+        bt["column"]: bt["ids"][barrier_idx]
+    })
+
+
+def init_worker(barrier_types: dict) -> None:
+    """
+    Store the barriers in the worker process.
+
+    Used as the initializer of the pool, so the barriers are sent to each\
+    worker only once instead of with every chunk. Pickling drops the\
+    prepared state of the geometries, so they are prepared again.
+
+    :param barrier_types: a dictionary containing infor to handle barriers
+    """
+    global shared_barrier_types
+    for bt in barrier_types.values():
+        if "geoms" in bt:
+            shapely.prepare(bt["geoms"])
+    shared_barrier_types = barrier_types
+
+
+def kernel(
+    barrier_type: Literal["road1", "road2", "railways", "river", "districts",
+                          "neighborhoods"],
+    trips: gpd.GeoDataFrame
+) -> pd.DataFrame:
+    global shared_barrier_types
+    return find_crossing_pairs(barrier_type, shared_barrier_types, trips)
+
+
 def calculate_crossings_dataframe(
     network: str,
     barrier_type: Literal["road1", "road2", "railways", "river", "districts",
                           "neighborhoods"],
-    barrier_types: dict, trips: gpd.GeoDataFrame
+    barrier_types: dict, trips: gpd.GeoDataFrame,
+    pool: Optional[PoolType] = None, chunks: int = 1
 ) -> pd.DataFrame:
     """
     Calculate barrier crossings.
@@ -37,7 +137,8 @@ def calculate_crossings_dataframe(
     The algorithm considers trips in straight line, the intersections of the\
     trip lines are counted by the specified barrier.
 
-    The result is written to a gzipped CSV file.
+    If a pool is given, the trips are split into *chunks* and the\
+    intersecting pairs of the chunks are searched in parallel.
 
     :param network: network ID, e.g., observed or seed4_2
     :param barrier_type: one of the following
@@ -49,6 +150,8 @@ def calculate_crossings_dataframe(
     - *neighborhhods*: OSM admin level 10
     :param barrier_types: a dictionary containing infor to handle barriers
     :param trips: beeline trips as LineStrings in GeoPandas GeoDataFrame format
+    :param pool: process pool initialized by :py:func:`init_worker`
+    :param chunks: number of trip chunks, only used with *pool*
 
     :return: DataFrame with three columns: *source*, *target*, *count*
 
@@ -73,8 +176,16 @@ def calculate_crossings_dataframe(
     2       3       6      1
     """
     column = barrier_types[barrier_type]["column"]
-    bc = trips.sjoin(barrier_types[barrier_type]["data"])\
-              .groupby(["source", "target"])\
+    if pool is None or len(trips) == 0:
+        pairs = find_crossing_pairs(barrier_type, barrier_types, trips)
+    else:
+        size = -(-len(trips) // chunks)
+        pairs = pd.concat(pool.imap_unordered(
+            partial(kernel, barrier_type),
+            (trips.iloc[k:k + size] for k in range(0, len(trips), size))
+        ))
+
+    bc = pairs.groupby(["source", "target"])\
               .agg(count=pd.NamedAgg(column, "nunique"))
     return bc.reset_index()
 
@@ -83,7 +194,8 @@ def calculate_crossings(
     network: str,
     barrier_type: Literal["road1", "road2", "railways", "river", "districts",
                           "neighborhoods"],
-    barrier_types: dict, trips: gpd.GeoDataFrame, output: str
+    barrier_types: dict, trips: gpd.GeoDataFrame, output: str,
+    pool: Optional[PoolType] = None, chunks: int = 1
 ) -> None:
     """
     Calculate barrier crossings and save the result.
@@ -104,6 +216,8 @@ def calculate_crossings(
     :param barrier_types: a dictionary containing infor to handle barriers
     :param trips: beeline trips as LineStrings in GeoPandas GeoDataFrame format
     :param output: output directory
+    :param pool: process pool initialized by :py:func:`init_worker`
+    :param chunks: number of trip chunks, only used with *pool*
     """
     path = f"{output}/{network}"
     filename = barrier_type
@@ -113,7 +227,9 @@ def calculate_crossings(
         network,
         barrier_type,
         barrier_types,
-        trips
+        trips,
+        pool=pool,
+        chunks=chunks
     ).to_csv(f"{path}/{barrier_type}.csv.gz", index=False)
 
 
@@ -137,22 +253,25 @@ def read_barrier_data(
     - **adm10**: neightborhoods
 
     .. warning::
-        Code assumes as inputs: name_unioned_roads_mp.geojson (road1),\
-        name_unioned_roads_s.geojson (road2),\
-        railways.geojson and duna.geojson.
+        Code assumes as inputs: name_unioned_roads_mp.parquet (road1),\
+        name_unioned_roads_s.parquet (road2),\
+        railways.parquet (GeoParquet outputs of get_roads.py) and\
+        duna.geojson. The GeoJSON outputs of earlier versions of\
+        get_roads.py are read if the GeoParquet files do not exist.
     """
-    road1 = gpd.read_file(f"{roads_path}/name_unioned_roads_mp.geojson",
-                          engine="pyogrio")
-    road2 = gpd.read_file(f"{roads_path}/name_unioned_roads_s.geojson",
-                          engine="pyogrio")
-    railw = gpd.read_file(f"{roads_path}/railways.geojson", engine="pyogrio")
-    river = gpd.read_file(river_path, engine="pyogrio")
+    # imported here, so the spawned workers do not import osmnx
+    from get_roads import read_geodata
+
+    road1 = read_geodata(f"{roads_path}/name_unioned_roads_mp")
+    road2 = read_geodata(f"{roads_path}/name_unioned_roads_s")
+    railw = read_geodata(f"{roads_path}/railways")
+    river = gpd.read_file(river_path, engine="pyogrio", use_arrow=True)
     # river.set_crs(23700, inplace=True)
     # river.to_crs(4326, inplace=True)
     distr = gpd.read_file(f"{admin_path}/budapest_districts.geojson",
-                          engine="pyogrio")
+                          engine="pyogrio", use_arrow=True)
     adm10 = gpd.read_file(f"{admin_path}/admin10.geojson",
-                          engine="pyogrio")
+                          engine="pyogrio", use_arrow=True)
 
     return road1, road2, railw, river, distr, adm10
 
@@ -172,6 +291,10 @@ if __name__ == "__main__":
               "neighborhoods"))
     parser.add_argument("--multithreading", action="store_true")
     parser.add_argument("--pool", type=int, required=False)
+    parser.add_argument(
+        "--chunks", type=int, required=False,
+        help=("split the trips into this many chunks and process them in "
+              "parallel, barrier types are processed one after the other"))
     parser.add_argument("--admin-data", type=str, required=False,
                         default="data",
                         help="directory where administrative barriers are")
@@ -190,12 +313,12 @@ if __name__ == "__main__":
     road1, road2, railw, river, distr, \
         adm10 = read_barrier_data(opts.roads, opts.admin_data, opts.river)
     barrier_types = {
-        "road1": {"data": road1, "column": "name"},
-        "road2": {"data": road2, "column": "name"},
-        "railways": {"data": railw, "column": "ref"},
-        "river": {"data": river, "column": "index_right"},
-        "districts": {"data": distr, "column": "did"},
-        "neighborhoods": {"data": adm10, "column": "id"}
+        "road1": index_barrier(road1, "name"),
+        "road2": index_barrier(road2, "name"),
+        "railways": index_barrier(railw, "ref"),
+        "river": index_barrier(river, "index_right"),
+        "districts": index_barrier(distr, "did"),
+        "neighborhoods": index_barrier(adm10, "id")
     }
 
     trips = pd.read_pickle(
@@ -207,7 +330,15 @@ if __name__ == "__main__":
     if opts.pool:
         pool = opts.pool
 
-    if opts.multithreading:
+    if opts.chunks:
+        ctx = get_context("spawn")
+        with ctx.Pool(opts.pool or cpu_count(), initializer=init_worker,
+                      initargs=(barrier_types,)) as p:
+            for i in opts.barrier_types:
+                calculate_crossings(opts.network, i, barrier_types, trips,
+                                    output=opts.output, pool=p,
+                                    chunks=opts.chunks)
+    elif opts.multithreading:
         with Pool(pool) as p:
             p.starmap(
                 calculate_crossings,
@@ -1,82 +1,136 @@
 import pathlib
 import pandas as pd
-import geopandas as gpd
 import numpy as np
-import networkx as nx
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyogrio
+from typing import Optional
+from functools import partial
+from itertools import product
+from concurrent.futures import ProcessPoolExecutor
+
+
+def load_communities(run_res: tuple[int, float], path: str) -> pd.DataFrame:
+    """
+    Read the communities of a run and resolution.
+
+    :param run_res: run and resolution
+    :param path: directory of the data
+
+    :return: block IDs with their communities, run and resolution
+
+    .. note::
+        The GeoParquet written by :py:mod:`place_network_louvain` is read if\
+        it exists, otherwise the GeoJSON.
+    """
+    run, res = run_res
+    filename = f"{path}/{run}/2019-09-01_2020-02-29_resolution{res}"
+    # the geometries are not needed, so they are not even parsed
+    if pathlib.Path(f"{filename}.parquet").exists():
+        temp = pd.read_parquet(f"{filename}.parquet",
+                               columns=["id", "community"])
+    else:
+        temp = pyogrio.read_dataframe(f"{filename}.geojson",
+                                      columns=["id", "community"],
+                                      read_geometry=False)
+    temp["run"] = run
+    temp["res"] = res
+    return temp
+
+
+COMMUNITY_SCHEMA = pa.schema([("id", pa.int32()), ("community", pa.float64()),
+                              ("run", pa.int32()), ("res", pa.float64())])
 
 
 def read_community_data(
     path: str,
     run_range: range,
-    resolution_range: np.ndarray
+    resolution_range: np.ndarray,
+    workers: Optional[int] = None
 ) -> pd.DataFrame:
     """
     Read or generate (if not exist) the communities per resolution and run.
 
+    The community files are independent, so they are read by a process pool.\
+    Each of them is appended to the cache as soon as it is read, so the\
+    frames are not collected in memory, then the cache is read back.
+
+    The cache is a Parquet file with a row group per run and resolution, so\
+    only the row groups of the requested runs and resolutions are read.
+
     :param path: directory of the data
     :param run_range: range of the different community detection runs\
         to iterate over
     - from 0 to 20 (excluded) in the paper
     :param resolution_range: range of the resolution to iterate over
     - from 1.0 to 10.5 (excluded) by 0.5 steps in the paper
+    :param workers: number of processes, all CPUs by default
 
     :return: communities per resolution and run
     """
-    try:
-        comm = pd.read_csv(f"{path}/communities_per_res_and_run.csv.gz")
-    except FileNotFoundError:
-        # 2m 25s
-        comm = pd.DataFrame()
-        for run in run_range:
-            for res in resolution_range:
-                temp = gpd.read_file(
-                    f"{path}/{run}/"
-                    f"2019-09-01_2020-02-29_resolution{res}.geojson",
-                    engine="pyogrio")
-                temp["run"] = run
-                temp["res"] = res
-                temp.drop(["area", "geometry"], axis=1, inplace=True)
-                comm = pd.concat([comm, temp])
-        comm.dropna(subset=["community"], inplace=True)
-        comm.to_csv(f"{path}/communities_per_res_and_run.csv.gz",
-                    index=False)
-    return comm
-
-
-def read_barrier_crossing_data(
-    path: str, network: str
-) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame,
-           pd.DataFrame, pd.DataFrame]:
+    cache = pathlib.Path(f"{path}/communities_per_res_and_run.parquet")
+    if not cache.exists():
+        # 2m 25s sequentially
+        partial_cache = cache.with_name(cache.name + ".part")
+        with ProcessPoolExecutor(max_workers=workers) as ex, \
+                pq.ParquetWriter(partial_cache, COMMUNITY_SCHEMA,
+                                 compression="zstd") as writer:
+            frames = ex.map(partial(load_communities, path=path),
+                            product(run_range, resolution_range))
+            for temp in frames:
+                writer.write_table(pa.Table.from_pandas(
+                    temp.dropna(subset=["community"]),
+                    schema=COMMUNITY_SCHEMA, preserve_index=False))
+        # an interrupted run does not leave an incomplete cache behind
+        partial_cache.rename(cache)
+    # the row group statistics let the filters skip the other runs
+    return pq.read_table(cache, filters=[
+        ("run", "in", list(run_range)),
+        ("res", "in", [float(res) for res in resolution_range])
+    ]).to_pandas()
+
+
+def read_barrier_crossing_data(path: str, network: str) -> pd.DataFrame:
     """
     Read the network-specific barrier crossing data.
 
+    The six barrier crossing CSVs are converted to a single Parquet file\
+    (*barriers.parquet*) at the first read, later reads load only that. The\
+    cache is rebuilt if any of the CSVs is newer, e.g., the barrier\
+    crossings are recalculated.
+
     :param network: the ID of the network
 
-    :return: six DataFrames with the barrier crossing data.
-    - bc_road1: OSM motorways and primary road crossing count per edge
-    - bc_road2: OSM secondary and primary road crossing count per edge
-    - bc_railw: railway crossing count per edge
-    - bc_river: river crossing count
-    - bc_distr: district crossing count
-    - bc_adm10: neighborhood crossing count
+    :return: DataFrame with the source, target and the count columns.
+    - road1_count: OSM motorways and primary road crossing count per edge
+    - road2_count: OSM secondary and primary road crossing count per edge
+    - railways_count: railway crossing count per edge
+    - river_count: river crossing count
+    - districts_count: district crossing count
+    - neighborhoods_count: neighborhood crossing count
 
     .. note::
-        Every returned DataFrames has three columns: source, target and count.
+        Edges without crossing of a barrier type have NaN count for it.
     """
-    bc_road1 = pd.read_csv(f"{path}/{network}/road1.csv.gz")
-    bc_road1.columns = ["source", "target", "road1_count"]
-    bc_road2 = pd.read_csv(f"{path}/{network}/road2.csv.gz")
-    bc_road2.columns = ["source", "target", "road2_count"]
-    bc_railw = pd.read_csv(f"{path}/{network}/railways.csv.gz")
-    bc_railw.columns = ["source", "target", "railways_count"]
-    bc_river = pd.read_csv(f"{path}/{network}/river.csv.gz")
-    bc_river.columns = ["source", "target", "river_count"]
-    bc_distr = pd.read_csv(f"{path}/{network}/districts.csv.gz")
-    bc_distr.columns = ["source", "target", "districts_count"]
-    bc_adm10 = pd.read_csv(f"{path}/{network}/neighborhoods.csv.gz")
-    bc_adm10.columns = ["source", "target", "neighborhoods_count"]
-
-    return bc_road1, bc_road2, bc_railw, bc_river, bc_distr, bc_adm10
+    barriers = ["road1", "road2", "railways", "river", "districts",
+                "neighborhoods"]
+    csvs = [pathlib.Path(f"{path}/{network}/{b}.csv.gz") for b in barriers]
+    cache = pathlib.Path(f"{path}/{network}/barriers.parquet")
+    if cache.exists() and cache.stat().st_mtime >= max(
+            csv.stat().st_mtime for csv in csvs):
+        return pd.read_parquet(cache)
+
+    frames = []
+    for barrier, csv in zip(barriers, csvs):
+        bc = pd.read_csv(csv)
+        bc.columns = ["source", "target", f"{barrier}_count"]
+        frames.append(bc.set_index(["source", "target"]))
+    bc = pd.concat(frames, axis=1, join="outer").reset_index()
+    # an interrupted write does not leave an incomplete cache behind
+    part = cache.with_name(f"{cache.name}.part")
+    bc.to_parquet(part, index=False)
+    part.replace(cache)
+    return bc
 
 
 def merge_network_with_barrier_data(
@@ -85,21 +139,30 @@ def merge_network_with_barrier_data(
     """
     Merge network with barrier data and replaces NAs with zero.
 
+    The (source, target) pairs of the network are factorized once, the\
+    barrier crossing data is looked up among the unique pairs and the\
+    counts are gathered by the codes, instead of merging the network with\
+    the crossing data.
+
     :param df: network as edglist DataFrame
     :param network: network ID.
     :param path: path for barrier crossing data
 
     :return: the merged DataFrame.
     """
-    road1, road2, railw, river, distr, \
-        adm10 = read_barrier_crossing_data(path, network)
-    m = df.merge(road1, on=["source", "target"], how="left")\
-          .merge(road2, on=["source", "target"], how="left")\
-          .merge(railw, on=["source", "target"], how="left")\
-          .merge(river, on=["source", "target"], how="left")\
-          .merge(distr, on=["source", "target"], how="left")\
-          .merge(adm10, on=["source", "target"], how="left")
-    m.fillna(0, inplace=True)
+    codes, uniques = pd.factorize(
+        pd.MultiIndex.from_arrays([df["source"], df["target"]]))
+    bc = read_barrier_crossing_data(path, network)
+    columns = list(bc.columns.drop(["source", "target"]))
+    position = uniques.get_indexer(
+        pd.MultiIndex.from_arrays([bc["source"], bc["target"]]))
+    found = position >= 0
+    # pairs without barrier crossing data are zero
+    counts = np.zeros((len(uniques), len(columns)))
+    counts[position[found]] = bc.loc[found, columns].fillna(0).to_numpy(
+        dtype=np.float64)
+    m = df.copy()
+    m[columns] = counts[codes]
     return m
 
 
@@ -107,40 +170,77 @@ def merge_with_communities(
     m: pd.DataFrame, comm: pd.DataFrame,
     run_range: range, resolution_range: np.ndarray
 ) -> tuple[pd.DataFrame, pd.DataFrame]:
-    intra = pd.DataFrame()
-    inter = pd.DataFrame()
-    for run in run_range:
-        for res in resolution_range:
-            c = comm.query(f"run == {run} & res == {res}").copy()
-            q = m.merge(c.rename({"id": "source"}, axis=1), on="source")\
-                .merge(c.rename({"id": "target"}, axis=1), on="target",
-                       suffixes=["_source", "_target"])
-
-            columns_to_sum = ["road1_count", "road2_count", "railways_count",
-                              "river_count", "districts_count",
-                              "neighborhoods_count"]
-            bc_inter = q.query(
-                "community_source != community_target"
-            )[columns_to_sum].sum()
-            bc_intra = q.query(
-                "community_source == community_target"
-            )[columns_to_sum].sum()
-            bc_inter = bc_inter.reset_index()
-            bc_inter.columns = ["barrier", "count"]
-            bc_inter["run"] = run
-            bc_inter["res"] = res
-
-            bc_intra = bc_intra.reset_index()
-            bc_intra.columns = ["barrier", "count"]
-            bc_intra["run"] = run
-            bc_intra["res"] = res
-
-            intra = pd.concat([intra, bc_intra])
-            inter = pd.concat([inter, bc_inter])
-    return inter, intra
+    """
+    Sum the barrier crossings of the inter- and intra-community edges.
+
+    The communities are laid out in a block x (run, resolution) table of\
+    categorical codes once, so the communities of the edge endpoints are\
+    gathered by position and compared as integers, instead of merging the\
+    network with the communities of every run and resolution. Edges with an\
+    endpoint without community are skipped.
+    The crossing counts of an edge are multiplied by its weight, as if the\
+    edge was repeated weight times.
+
+    :param m: network merged with the barrier crossing data
+    - by :py:func:`merge_network_with_barrier_data`, if it has a *weight*\
+        column, the counts are weighted by it
+    :param comm: communities per resolution and run
+    - by :py:func:`read_community_data`
+    :param run_range: range of the different community detection runs
+    :param resolution_range: range of the resolution
+
+    :return: inter- and intra-community barrier crossing counts, with the\
+        *barrier*, *count*, *run* and *res* columns
+    """
+    columns_to_sum = ["road1_count", "road2_count", "railways_count",
+                      "river_count", "districts_count",
+                      "neighborhoods_count"]
+    keys = pd.MultiIndex.from_product([run_range, resolution_range],
+                                      names=["run", "res"])
+    ids = pd.Index(comm["id"].unique())
+    column = keys.get_indexer(pd.MultiIndex.from_arrays([comm["run"],
+                                                         comm["res"]]))
+    listed = column >= 0
+    # -1 marks the blocks without community in a run and resolution
+    values = np.full((len(ids), len(keys)), -1, dtype=np.int32)
+    values[ids.get_indexer(comm["id"])[listed], column[listed]] = \
+        comm["community"].astype("category").cat.codes.values[listed]
+
+    source = ids.get_indexer(m["source"])
+    target = ids.get_indexer(m["target"])
+    found = (source >= 0) & (target >= 0)
+    source, target = source[found], target[found]
+    counts = m.loc[found, columns_to_sum].to_numpy(dtype=np.float64)
+    if "weight" in m.columns:
+        counts *= m.loc[found, "weight"].to_numpy(dtype=np.float64)[:, None]
+
+    inter = np.zeros((len(keys), len(columns_to_sum)))
+    intra = np.zeros((len(keys), len(columns_to_sum)))
+    for k in range(len(keys)):
+        c_source, c_target = values[source, k], values[target, k]
+        valid = (c_source >= 0) & (c_target >= 0)
+        same = valid & (c_source == c_target)
+        intra[k] = counts[same].sum(axis=0)
+        inter[k] = counts[valid & ~same].sum(axis=0)
+
+    def to_frame(sums: np.ndarray) -> pd.DataFrame:
+        n = len(columns_to_sum)
+        return pd.DataFrame({
+            "barrier": np.tile(columns_to_sum, len(keys)),
+            "count": sums.ravel(),
+            "run": np.repeat(keys.get_level_values("run"), n),
+            "res": np.repeat(keys.get_level_values("res"), n)
+        })
+
+    return to_frame(inter), to_frame(intra)
 
 
 def calc_ratio(inter: pd.DataFrame, intra: pd.DataFrame) -> pd.DataFrame:
+    # the barrier names are merged on their categorical codes
+    barrier = pd.CategoricalDtype(
+        inter["barrier"].drop_duplicates().tolist())
+    inter = inter.astype({"barrier": barrier})
+    intra = intra.astype({"barrier": barrier})
     bc = inter.reset_index()\
             .merge(intra.reset_index(), on=["run", "res", "barrier"],
                    suffixes=["_inter", "_intra"])\
@@ -157,15 +257,35 @@ def read_network(name: str, path: str) -> pd.DataFrame:
     :param name: network ID
     :param path: directory with the networks
 
-    :return: network in a Pandas DataFrame format.
+    :return: network in a Pandas DataFrame format, one row per edge with\
+        its *weight*
+
+    .. note::
+        The edgelist is parsed directly, without building a NetworkX graph.\
+        The lines are expected in the ``u v {'weight': w}`` format, as\
+        written by ``nx.write_edgelist``. The edges are oriented and ordered\
+        as ``nx.to_pandas_edgelist(nx.read_edgelist(...))`` would do it,\
+        so they match the keys of the barrier crossing data.
     """
-    G = nx.read_edgelist(f"{path}/{name}.edgelist.gz")
-    df = nx.to_pandas_edgelist(G)
-    df["source"] = pd.to_numeric(df["source"])
-    df["target"] = pd.to_numeric(df["target"])
-    df = df.loc[df.index.repeat(df["weight"])]\
-           .drop("weight", axis=1).reset_index(drop=True).copy()
-    return df
+    df = pd.read_csv(f"{path}/{name}.edgelist.gz", sep=" ", header=None,
+                     names=["source", "target", "key", "weight"],
+                     usecols=["source", "target", "weight"],
+                     dtype={"source": np.int32, "target": np.int32,
+                            "weight": str})
+    df["weight"] = pd.to_numeric(df["weight"].str.rstrip("}"))
+
+    # a Graph reports an edge from its endpoint inserted first, the nodes are
+    # inserted in the order of their first appearance in the file
+    nodes = pd.Index(pd.unique(df[["source", "target"]].to_numpy().ravel()))
+    rank_source = nodes.get_indexer(df["source"])
+    rank_target = nodes.get_indexer(df["target"])
+    flip = rank_target < rank_source
+    df.loc[flip, ["source", "target"]] = \
+        df.loc[flip, ["target", "source"]].to_numpy()
+    # the edges of a node are reported in insertion (line) order
+    order = np.argsort(np.where(flip, rank_target, rank_source),
+                       kind="stable")
+    return df.iloc[order].reset_index(drop=True)
 
 
 def generate_community_crossing_data(
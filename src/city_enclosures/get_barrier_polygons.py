@@ -1,8 +1,9 @@
 """Get barrier polygons from OSM."""
 
 import geopandas as gpd
+import numpy as np
 import osmnx as ox
-import pandas as pd
+import shapely
 from shapely.ops import polygonize
 
 ox.settings.use_cache = True
@@ -134,8 +135,6 @@ if __name__ == "__main__":
         railways = ox.graph_to_gdfs(g_rw, nodes=False)
         barriers_elements.append(railways.geometry)
 
-    barriers = pd.concat(barriers_elements)
-
     if opts.river:
         river = gpd.read_file(opts.river).set_crs(crs=4326)
         river = gpd.clip(river, area)
@@ -143,9 +142,12 @@ if __name__ == "__main__":
             river.to_crs(opts.river_shrink_crs).buffer(-opts.river_shrink).to_crs(4326)
         )
 
-        barriers = pd.concat([barriers, gpd.GeoSeries(river.boundary)])
+        barriers_elements.append(river.boundary)
 
-    unioned = barriers.union_all()
+    # the geometry arrays are unioned directly, without building a GeoSeries
+    unioned = shapely.unary_union(
+        np.concatenate([np.asarray(b.values) for b in barriers_elements])
+    )
 
     polygons = polygonize(unioned)
     enclosures = gpd.array.from_shapely(list(polygons), crs=4326)
@@ -153,9 +155,12 @@ if __name__ == "__main__":
     enclosures_gdf = gpd.GeoDataFrame(geometry=gpd.GeoSeries(enclosures), crs=4326)
 
     if opts.river:
-        enclosures_gdf = enclosures_gdf[
-            ~enclosures_gdf["geometry"].intersects(shrank_river.union_all())
-        ]
+        # the tree prunes the enclosures far from the river before the test
+        tree = shapely.STRtree(enclosures_gdf.geometry.values)
+        hit = tree.query(shrank_river.union_all(), predicate="intersects")
+        keep = np.ones(len(enclosures_gdf), dtype=bool)
+        keep[hit] = False
+        enclosures_gdf = enclosures_gdf[keep]
 
     enclosures_gdf = gpd.clip(enclosures_gdf, area)
     enclosures_gdf = enclosures_gdf[
@@ -181,4 +186,5 @@ if __name__ == "__main__":
         enclosures_gdf = enclosures_gdf[enclosures_gdf["area"] >= opts.threshold].copy()
 
     enclosures_gdf.to_file(opts.output + ".geojson", driver="GeoJSON")
-    enclosures_gdf.to_csv(opts.output + ".csv", index=False)
+    # GeoParquet keeps the geometries as WKB instead of WKT text
+    enclosures_gdf.to_parquet(opts.output + ".parquet", index=False)
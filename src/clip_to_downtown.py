@@ -1,9 +1,8 @@
 import geopandas as gpd
+import numpy as np
 import pandas as pd
-
-downtown = gpd.read_file("../data/downtown.geojson").set_crs(4326).to_crs(23700)
-downtown_poly = downtown.geometry[0]
-blocks = gpd.read_file("../data/house_blocks.geojson").set_crs(4326).to_crs(23700)
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
 
 targets = [
     "2019-06-01_2019-06-02",
@@ -16,9 +15,58 @@ targets = [
     "2019-07-20_2019-07-21",
     "2019-07-27_2019-07-28",
 ]
-for target in targets:
+
+
+def in_area(values: pd.Series, lookup: np.ndarray) -> np.ndarray:
+    """
+    Check which block IDs are inside the area.
+
+    :param values: block IDs, possibly as floats (e.g., *9376.0*)
+    :param lookup: boolean array, True at the indices of the blocks inside
+
+    :return: boolean mask
+
+    ###### Example
+    >>> in_area(pd.Series([1.0, 2.0, 2.5, 7.0]), np.array([0, 1, 0], bool))
+    array([ True, False, False, False])
+    """
+    values = values.to_numpy(dtype=np.float64)
+    # only the whole block IDs that fit into the lookup array can be inside
+    mask = (values >= 0) & (values < len(lookup)) & (values == np.floor(values))
+    mask[mask] = lookup[values[mask].astype(np.int64)]
+    return mask
+
+
+def clip(target: str, lookup: np.ndarray) -> str:
+    """
+    Keep the place connections inside the downtown area.
+
+    :param target: date range of the place connections file
+    :param lookup: boolean array, True at the IDs of the blocks intersecting\
+        the downtown area
+
+    :return: the target
+    """
     data = pd.read_csv(f"../data/place_connections_{target}.csv")
-    in_area = blocks[blocks.geometry.intersects(downtown_poly)].copy()
-    data[
-        (data["target"].isin(in_area["id"])) & (data["source"].isin(in_area["id"]))
-    ].to_csv(f"../data/place_connections_{target}_downtown.csv", index=False)
+    mask = in_area(data["source"], lookup) & in_area(data["target"], lookup)
+    data[mask].to_csv(
+        f"../data/place_connections_{target}_downtown.csv", index=False
+    )
+    return target
+
+
+if __name__ == "__main__":
+    downtown = gpd.read_file("../data/downtown.geojson").set_crs(4326).to_crs(23700)
+    downtown_poly = downtown.geometry[0]
+    blocks = gpd.read_file("../data/house_blocks.geojson").set_crs(4326).to_crs(23700)
+
+    # the same for every target, so it is calculated only once
+    in_area_ids = blocks[blocks.geometry.intersects(downtown_poly)]["id"].to_numpy()
+    # the block IDs are dense, so a lookup array replaces the hash tables
+    lookup = np.zeros(blocks["id"].max() + 1, dtype=bool)
+    lookup[in_area_ids] = True
+
+    # the targets are independent files
+    with ProcessPoolExecutor() as ex:
+        for target in ex.map(clip, targets, repeat(lookup)):
+            print(target)
@@ -1,17 +1,60 @@
 """
 Convert place_connections pickle to NetworkX edgelist.
 
+The edgelist is written directly, in the format of ``nx.write_edgelist``.
+
 :param input: path to the output of build_network_from_places.ipynb
 :param output: output directory
 """
+import gzip
 import argparse
 from pathlib import Path
+import numpy as np
 import pandas as pd
-import networkx as nx
 
 START_DATE = "2019-09-01"
 END_DATE = "2020-02-29"
 
+
+def write_edgelist(df: pd.DataFrame, path: str) -> None:
+    """
+    Write a weighted edgelist as an undirected NetworkX edgelist.
+
+    The output is the same as building an ``nx.Graph`` by\
+    ``nx.from_pandas_edgelist`` and writing it by ``nx.write_edgelist``, but\
+    without materializing the graph:
+    - the nodes are ranked by their first appearance,
+    - an edge is written from its endpoint with the lower rank,
+    - the reversed duplicates are merged, with the weight of the last one,
+    - the edges are ordered by the rank of that endpoint, then by the first\
+        appearance of the edge.
+
+    :param df: DataFrame with *source*, *target* and *weight* columns
+    :param path: output path, compressed by gzip
+    """
+    nodes = pd.unique(df[["source", "target"]].to_numpy().ravel())
+    rank_source = pd.Index(nodes).get_indexer(df["source"])
+    rank_target = pd.Index(nodes).get_indexer(df["target"])
+    low = np.minimum(rank_source, rank_target)
+    high = np.maximum(rank_source, rank_target)
+    key = pd.Index(low.astype(np.int64) * len(nodes) + high)
+
+    first = ~key.duplicated(keep="first")
+    last = ~key.duplicated(keep="last")
+    weight = pd.Series(df["weight"].to_numpy()[last], index=key[last])\
+        .reindex(key[first])
+    edges = pd.DataFrame({
+        "source": pd.Series(nodes[low[first]]).astype(str),
+        "target": pd.Series(nodes[high[first]]).astype(str),
+        "weight": weight.astype(str).to_numpy()
+    }).iloc[np.argsort(low[first], kind="stable")]
+
+    lines = edges["source"] + " " + edges["target"] + " {'weight': " \
+        + edges["weight"] + "}\n"
+    with gzip.open(path, "wt", encoding="utf-8") as fp:
+        fp.write("".join(lines))
+
+
 parser = argparse.ArgumentParser()
 parser.add_argument(
     "--input",
@@ -38,10 +81,4 @@ Path(opts.output).mkdir(parents=True, exist_ok=True)
 observed = pd.read_csv(opts.input)
 observed = observed.groupby(["source", "target"])["weight"].sum().reset_index()
 
-G_obs = nx.from_pandas_edgelist(
-    observed,
-    source="source",
-    target="target",
-    edge_attr=["weight"]
-)
-nx.write_edgelist(G_obs, f"{opts.output}/observed{opts.suffix}.edgelist.gz")
+write_edgelist(observed, f"{opts.output}/observed{opts.suffix}.edgelist.gz")
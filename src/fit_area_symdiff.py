@@ -11,12 +11,16 @@ Calculate sysmmetric area difference between communities and barriers.
 :param run-stop: excluded upper limit of the run loop, 10 by default
 :param data: directory where the input data files can be found\
     (default `../data`)
+:param barrier-types: barrier types to compare the communities to, *river*\
+    by default, they are processed in parallel
+:param pool: number of parallel processes (default: number of CPUs)
 """
 from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import geopandas as gpd
 import pandas as pd
 import numpy as np
-from shapely import symmetric_difference
+import shapely
 from shapely.geometry import Polygon, MultiPolygon
 
 Options = namedtuple(
@@ -34,6 +38,16 @@ Options = namedtuple(
     ],
 )
 
+# barrier type: GeoJSON filename and ID column
+BARRIER_TYPES = {
+    "primary": ("barriers_mp.geojson", "id"),
+    "secondary": ("barriers_mps.geojson", "id"),
+    "districts": ("budapest_districts.geojson", "did"),
+    "neighborhoods": ("admin10.geojson", "name"),
+    "railways": ("barriers_railways.geojson", "id"),
+    "river": ("barriers_river.geojson", "id"),
+}
+
 
 def select_largest(mp: MultiPolygon) -> Polygon:
     """
@@ -87,8 +101,27 @@ def compare_communities_to_barriers(
 
     :return: DataFrame with the symmetric area difference between the\
         communities and the barriers per run and resolution
+
+    .. note::
+        The overlapping pairs are queried from an STRtree of the barriers,\
+        built once, and the symmetric difference areas are computed by\
+        vectorized calls per run and resolution. The barriers are prepared,\
+        so the candidate pairs are tested against their cached index.
+        The symmetric difference polygons are not built, its area equals\
+        area(A) + area(B) - 2 * area(intersection of A and B).
+
+    .. note::
+        The areas are calculated in EPSG:23700, the barriers are projected\
+        once if needed, the communities per file if they are in another CRS.
     """
-    result = []
+    if barriers.crs is not None and barriers.crs.to_epsg() != 23700:
+        barriers = barriers.to_crs(23700)
+    barrier_geoms = np.asarray(barriers.geometry.values)
+    shapely.prepare(barrier_geoms)
+    barrier_ids = barriers[id_column].values
+    barrier_areas = shapely.area(barrier_geoms)
+    tree = shapely.STRtree(barrier_geoms)
+    frames = []
     for run in range(options.run_start, options.run_stop):
         for res in np.arange(
             options.res_start, options.res_stop, options.res_step
@@ -98,16 +131,58 @@ def compare_communities_to_barriers(
                 f"{options.target}/{options.community_dir}/louvain/{run}/"
                 f"louvain_r{res}_merged.geojson"
             )
-            for c in communities.itertuples():
-                overlapping = barriers[
-                    barriers["geometry"].intersects(c.geometry)
-                ].copy()
-                for poly in overlapping.itertuples():
-                    diff = symmetric_difference(poly.geometry, c.geometry).area
-                    result.append(
-                        [run, res, c.id, getattr(poly, id_column), diff]
-                    )
-    return pd.DataFrame.from_records(result, columns=columns)
+            if communities.crs is not None and \
+                    communities.crs != barriers.crs:
+                communities = communities.to_crs(23700)
+            community_geoms = np.asarray(communities.geometry.values)
+            c_idx, b_idx = tree.query(community_geoms)
+            # the first argument is prepared, so its cached index is used
+            hit = shapely.intersects(barrier_geoms[b_idx],
+                                     community_geoms[c_idx])
+            c_idx, b_idx = c_idx[hit], b_idx[hit]
+            # same order as iterating the communities, then the barriers
+            order = np.lexsort((b_idx, c_idx))
+            c_idx, b_idx = c_idx[order], b_idx[order]
+            intersection_areas = shapely.area(shapely.intersection(
+                barrier_geoms[b_idx], community_geoms[c_idx]))
+            diffs = barrier_areas[b_idx] \
+                + shapely.area(community_geoms)[c_idx] \
+                - 2 * intersection_areas
+            frames.append(pd.DataFrame(dict(zip(columns, [
+                np.full(len(c_idx), run, dtype=np.int64),
+                np.full(len(c_idx), res, dtype=np.float64),
+                communities["id"].values[c_idx],
+                barrier_ids[b_idx],
+                diffs
+            ]))))
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(frames, ignore_index=True)
+
+
+def compare_barrier_type(
+    barrier_type: str, options: Options, data: str
+) -> str:
+    """
+    Compare communities to a barrier type and save the result as CSV.
+
+    :param barrier_type: key of :py:data:`BARRIER_TYPES`
+    :param options: options set by the CLI
+    :param data: directory of the barrier GeoJSONs
+
+    :return: the barrier type
+    """
+    filename, id_column = BARRIER_TYPES[barrier_type]
+    barriers = gpd.read_file(f"{data}/{filename}", engine="pyogrio")
+    barriers.to_crs(23700, inplace=True)
+    sad = compare_communities_to_barriers(
+        barriers, options, id_column=id_column
+    )
+    sad.to_csv(
+        f"{options.output}/communities_vs_{barrier_type}_area_symmdiff.csv",
+        index=False,
+    )
+    return barrier_type
 
 
 if __name__ == "__main__":
@@ -167,6 +242,21 @@ if __name__ == "__main__":
         default="output/symmetric_area_difference",
         help="output directory",
     )
+    parser.add_argument(
+        "--barrier-types",
+        type=str,
+        required=False,
+        nargs="+",
+        default=["river"],
+        choices=list(BARRIER_TYPES),
+        help="barrier types to compare the communities to",
+    )
+    parser.add_argument(
+        "--pool",
+        type=int,
+        required=False,
+        help="number of barrier types compared in parallel",
+    )
     opts = parser.parse_args()
 
     options = Options(
@@ -181,74 +271,13 @@ if __name__ == "__main__":
         community_dir=opts.community_dir,
     )
 
-    barriers_primary = gpd.read_file(f"{opts.data}/barriers_mp.geojson")
-    barriers_primary.to_crs(23700, inplace=True)
-
-    barriers_secondary = gpd.read_file(f"{opts.data}/barriers_mps.geojson")
-    barriers_secondary.to_crs(23700, inplace=True)
-
-    districts = gpd.read_file(f"{opts.data}/budapest_districts.geojson")
-    districts.to_crs(23700, inplace=True)
-
-    neighborhoods = gpd.read_file(f"{opts.data}/admin10.geojson")
-    neighborhoods.to_crs(23700, inplace=True)
-
-    railways = gpd.read_file(f"{opts.data}/barriers_railways.geojson")
-    railways.to_crs(23700, inplace=True)
-
-    river = gpd.read_file(
-        f"{opts.data}/barriers_river.geojson",
-        engine="pyogrio"
-    )
-    river.to_crs(23700, inplace=True)
-
     Path(opts.output).mkdir(parents=True, exist_ok=True)
 
-    # # runs 3m
-    # sad_p = compare_communities_to_barriers(barriers_primary, options)
-    # sad_p.to_csv(
-    #     f"{opts.output}/communities_vs_primary_area_symmdiff.csv", index=False
-    # )
-
-    # # runs 4m
-    # sad_s = compare_communities_to_barriers(barriers_secondary, options)
-    # sad_s.to_csv(
-    #     f"{opts.output}/communities_vs_secondary_area_symmdiff.csv",
-    #     index=False,
-    # )
-
-    # # runs 3m
-    # sad_d = compare_communities_to_barriers(
-    #     districts, options, id_column="did"
-    # )
-    # sad_d.to_csv(
-    #     f"{opts.output}/communities_vs_districts_area_symmdiff.csv",
-    #     index=False,
-    # )
-
-    # # runs 4m
-    # sad_n = compare_communities_to_barriers(
-    #     neighborhoods, options, id_column="name"
-    # )
-    # sad_n.to_csv(
-    #     f"{opts.output}/communities_vs_neighborhoods_area_symmdiff.csv",
-    #     index=False,
-    # )
-
-    # # runs ?m
-    # sad_rw = compare_communities_to_barriers(
-    #     railways, options, id_column="id"
-    # )
-    # sad_rw.to_csv(
-    #     f"{opts.output}/communities_vs_railways_area_symmdiff.csv",
-    #     index=False,
-    # )
-
-    # runs ?m
-    sad_r = compare_communities_to_barriers(
-        river, options, id_column="id"
-    )
-    sad_r.to_csv(
-        f"{opts.output}/communities_vs_river_area_symmdiff.csv",
-        index=False,
-    )
+    # the barrier types are independent, so they are compared in parallel
+    with ProcessPoolExecutor(max_workers=opts.pool) as ex:
+        futures = [
+            ex.submit(compare_barrier_type, b, options, opts.data)
+            for b in opts.barrier_types
+        ]
+        for future in as_completed(futures):
+            print(f"{future.result()} done")
@@ -12,17 +12,25 @@ Generate beeline trips from a network.
 :param output [str]: output directory (default ``output/trips``).
 """
 from pathlib import Path
+from typing import Optional
+import numpy as np
 import pandas as pd
 import geopandas as gpd
 import networkx as nx
+import shapely
 from shapely.geometry import LineString
+from generate_full_mesh import load_centroids
+from calculate_community_crossings import read_network
 
 
-def convert_network_to_dataframe(G: nx.Graph) -> pd.DataFrame:
+def convert_network_to_dataframe(G: nx.Graph,
+                                 repeat: bool = True) -> pd.DataFrame:
     """
     Convert network to dataframe.
 
     :param G: network in NetworkX Graph format.
+    :param repeat: if True, the edges are repeated by their weights,\
+        otherwise the weights are kept in a *weight* column.
 
     :return: network as edge list dtored in a Pandas Dataframe.
 
@@ -50,13 +58,21 @@ def convert_network_to_dataframe(G: nx.Graph) -> pd.DataFrame:
         1       1       2
         2       1       3
 
+    >>> convert_network_to_dataframe(G, repeat=False)
+    ... # doctest: +NORMALIZE_WHITESPACE
+            source  target  weight
+        0       1       2       2
+        1       1       3       1
+
     """
     df = nx.to_pandas_edgelist(G)
-    df["source"] = pd.to_numeric(df["source"])
-    df["target"] = pd.to_numeric(df["target"])
-    df = df.loc[df.index.repeat(df["weight"])]\
-           .drop("weight", axis=1).reset_index(drop=True).copy()
-    return df
+    # the block IDs may be stored as floats in the edgelist, e.g., 11651.0
+    edges = {c: pd.to_numeric(df[c]).to_numpy(dtype=np.int32)
+             for c in ["source", "target"]}
+    weight = df["weight"].to_numpy()
+    if not repeat:
+        return pd.DataFrame(edges | {"weight": weight})
+    return pd.DataFrame({c: np.repeat(v, weight) for c, v in edges.items()})
 
 
 def create_linestring(x: pd.Series) -> LineString:
@@ -90,31 +106,41 @@ def prepare_house_blocks(filename: str) -> gpd.GeoDataFrame:
     This method expects that the blocks are downloaded OpenStreetMap with a\
     script that includes the area of the polygon and the CRS is EPSG:4326.
 
-    The are column is dropped, and the polygon geometry is replaced with a\
-    point which is the centroid of the polygon.
-    To determine the centroid a meter-based projection is used. As the project\
-    assumes Hungary, it is EPSG:23700.
+    Only the ID column is kept, and the polygon geometry is replaced with a\
+    point which is the centroid of the polygon, see\
+    :py:func:`generate_full_mesh.load_centroids`. The centroids are cached,\
+    so the GeoJSON is read only once.
 
     :param filename: filename for the shapefile with the blocks.
 
     :return: GeoPandas GeoDataFrame containing the blocks.
     """
-    hb = gpd.read_file(filename, crs=4326)
-    hb.drop("area", axis=1, inplace=True)
-    hb.to_crs(23700, inplace=True)
-    hb["geometry"] = hb.geometry.centroid
-    hb.to_crs(4326, inplace=True)
+    return load_centroids(filename)
 
-    hb["lon"] = hb.geometry.x
-    hb["lat"] = hb.geometry.y
-    # hb_dict = hb[["id", "lon", "lat"]].to_dict(orient="records")
-    hb.drop(["lon", "lat"], axis=1, inplace=True)
 
-    return hb
+def block_lookup(hb: gpd.GeoDataFrame) -> tuple[pd.Index, np.ndarray]:
+    """
+    Build the lookup of the block centroids.
+
+    :param hb: GeoPandas GeoDataFrame containing the blocks.
+
+    :return: index of the block IDs and the centroid coordinates in the same\
+        order
+
+    ###### Example
+    >>> from shapely.geometry import Point
+    >>> hb = gpd.GeoDataFrame({"id": [7, 3]},
+    ...                       geometry=[Point(0, 1), Point(2, 3)])
+    >>> ids, xy = block_lookup(hb)
+    >>> ids.get_indexer([3, 7, 5]), xy[1]
+    (array([ 1,  0, -1]), array([2., 3.]))
+    """
+    return pd.Index(hb["id"]), shapely.get_coordinates(hb.geometry.to_numpy())
 
 
 def generate_beeline_trips(
-    network: str, path: str, hb: gpd.GeoDataFrame
+    network: str, path: str, hb: gpd.GeoDataFrame,
+    lookup: Optional[tuple[pd.Index, np.ndarray]] = None
 ) -> pd.DataFrame:
     """
     Load a network and generate beeline trips from it.
@@ -123,12 +149,19 @@ def generate_beeline_trips(
     :param path: directory where the network edgelist is present with the\
         given network ID.
     :param hb: GeoPandas GeoDataFrame containing the blocks.
+    :param lookup: the result of :py:func:`block_lookup` on *hb*, built\
+        from *hb* if not given
 
     :return: Pandas DataFrame with the beeline trips.
-    """
-    nw = nx.read_edgelist(f"{path}/{network}.edgelist.gz")
 
-    return generate_beeline_trips_from_network(network, nw, hb)
+    .. note::
+        The edgelist is read by\
+        :py:func:`calculate_community_crossings.read_network`, without\
+        building a NetworkX graph. The edges are oriented as by NetworkX, so\
+        the trips match the keys of the community crossing calculation.
+    """
+    return generate_beeline_trips_from_edges(read_network(network, path), hb,
+                                             lookup)
 
 
 def generate_beeline_trips_from_network(
@@ -143,15 +176,45 @@ def generate_beeline_trips_from_network(
 
     :return: Pandas DataFrame with the beeline trips.
     """
-    df = convert_network_to_dataframe(nw)
+    return generate_beeline_trips_from_edges(
+        convert_network_to_dataframe(nw, repeat=False), hb)
+
 
-    hb.columns = ["source", "source_geometry"]
-    df = df.merge(hb, on="source")
-    hb.columns = ["target", "target_geometry"]
-    df = df.merge(hb, on="target")
-    df["geometry"] = df.apply(create_linestring, axis=1)
-    df.drop(["source_geometry", "target_geometry"], axis=1, inplace=True)
-    df.drop_duplicates(inplace=True)
+def generate_beeline_trips_from_edges(
+    df: pd.DataFrame, hb: gpd.GeoDataFrame,
+    lookup: Optional[tuple[pd.Index, np.ndarray]] = None
+) -> pd.DataFrame:
+    """
+    Generate beeline trips from an edge list.
+
+    :param df: edges with *source* and *target* block IDs, other columns\
+        (e.g., *weight*) are dropped
+    :param hb: GeoPandas GeoDataFrame containing the blocks.
+    :param lookup: the result of :py:func:`block_lookup` on *hb*, built\
+        from *hb* if not given
+
+    :return: Pandas DataFrame with the beeline trips.
+    """
+    # the trips are unique, so the edges are not repeated by their weights;
+    # the IDs are packed into one integer key, and the first occurrences are
+    # kept in their original order, as by drop_duplicates
+    source = df["source"].to_numpy(dtype=np.int64)
+    target = df["target"].to_numpy(dtype=np.int64)
+    key = (source << 32) | (target & 0xFFFFFFFF)
+    first = np.sort(np.unique(key, return_index=True)[1])
+    df = pd.DataFrame({"source": df["source"].to_numpy()[first],
+                       "target": df["target"].to_numpy()[first]})
+
+    # the block centroids are looked up by position instead of two merges
+    blocks, xy = block_lookup(hb) if lookup is None else lookup
+    source = blocks.get_indexer(df["source"])
+    target = blocks.get_indexer(df["target"])
+    # edges with an endpoint missing from the blocks are dropped, as by an
+    # inner merge
+    found = (source >= 0) & (target >= 0)
+    df = df[found].reset_index(drop=True)
+    df["geometry"] = shapely.linestrings(
+        np.stack([xy[source[found]], xy[target[found]]], axis=1))
 
     return df
 
@@ -172,12 +235,11 @@ def load_beeline_trips(
     try:
         df = pd.read_pickle(f"{trip_dir}/network_{network}_beeline.pickle")
     except FileNotFoundError:
-        nw = nx.read_edgelist(f"{network_dir}/{network}.edgelist.gz")
-        df = generate_beeline_trips(network, nw, hb)
+        df = generate_beeline_trips(network, network_dir, hb)
 
         if not Path(trip_dir).exists():
             Path(trip_dir).mkdir(parents=True, exist_ok=True)
-        df.to_pickle(f"{trip_dir}/network_{n}_beeline.pickle")
+        df.to_pickle(f"{trip_dir}/network_{network}_beeline.pickle")
     return df
 
 
@@ -224,6 +286,8 @@ if __name__ == "__main__":
     opts = parser.parse_args()
 
     hb = prepare_house_blocks(opts.blocks)
+    # the blocks are the same for every network
+    lookup = block_lookup(hb)
 
     if "--observed" in sys.argv:
         networks = [opts.observed]
@@ -231,12 +295,9 @@ if __name__ == "__main__":
         networks = [f"seed{opts.seed}_{i}"
                     for i in range(opts.number_of_networks)]
 
+    Path(opts.output).mkdir(parents=True, exist_ok=True)
     for n in networks:
-        nw = nx.read_edgelist(f"{opts.network_dir}/{n}.edgelist.gz")
-        df = generate_beeline_trips_from_network(n, nw, hb)
-
-        if not Path(opts.output).exists():
-            Path(opts.output).mkdir(parents=True, exist_ok=True)
+        df = generate_beeline_trips(n, opts.network_dir, hb, lookup)
         df.to_pickle(f"{opts.output}/network_{n}_beeline.pickle.gz")
         print(f"trips for {n} saved...")
     # runs 9m
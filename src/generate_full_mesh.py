@@ -1,54 +1,315 @@
 """Generate empty full mesh for gravity model."""
+import os
 import geopandas as gpd
 import numpy as np
 import logging
-from haversine import haversine, Unit
-from itertools import product
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import shapely
+from pyproj import Transformer
+from haversine import Unit
+from haversine.haversine import get_avg_earth_radius
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Literal, Optional, TextIO, Union
 
 
 logger = logging.getLogger("full mesh generator")
 logger.setLevel(logging.DEBUG)
 
+EARTH_RADIUS_KM = get_avg_earth_radius(Unit.KILOMETERS)
 
-def prepare_house_blocks(filename: str) -> gpd.GeoDataFrame:
+# the distances are rounded to meters, so float32 represents them closely
+MESH_SCHEMA = pa.schema([
+    ("source", pa.int32()), ("target", pa.int32()),
+    ("distance_ij", pa.float32()), ("p_i", pa.int32()), ("p_j", pa.int32()),
+])
+
+
+def load_centroids(filename: str, cache: Optional[str] = None,
+                   cache_dir: str = "output/cache") -> gpd.GeoDataFrame:
     """
-    Load the house block shapefile into a GeoDataFrame, and provides the \
-    location data in a tuple (lat, lon) required fo haversine calculation.
+    Load the centroids of the house blocks.
+
+    The GeoJSON is read and reprojected only once, then the centroids are\
+    cached as GeoParquet. The cache is rebuilt if the GeoJSON is newer.
+
+    To determine the centroid a meter-based projection is used. As the project\
+    assumes Hungary, it is EPSG:23700.
 
     :param filename: the path of the house block GeoJSON
-    :return: GeoDataFrame with a point column containing a tuple (lat, lon)
+    :param cache: the path of the cache (default: *_centroids.parquet* in\
+        *cache_dir*, e.g., ``output/cache/house_blocks_centroids.parquet``)
+    :param cache_dir: directory of the default cache, ignored by git, so\
+        the versioned data directory is left untouched
+    :return: GeoDataFrame with the id and the centroid of the blocks in\
+        EPSG:4326
+    """
+    if cache is None:
+        stem = os.path.splitext(os.path.basename(filename))[0]
+        cache = f"{cache_dir}/{stem}_centroids.parquet"
+    if os.path.exists(cache) and \
+            os.path.getmtime(cache) >= os.path.getmtime(filename):
+        return gpd.read_parquet(cache)
+
+    hb = gpd.read_file(filename, columns=["id"], engine="pyogrio",
+                       use_arrow=True)
+    # the coordinates are transformed in bulk, and only the centroids are
+    # transformed back, instead of reprojecting the whole GeoDataFrame twice
+    forward = Transformer.from_crs(hb.crs, 23700, always_xy=True)
+    inverse = Transformer.from_crs(23700, 4326, always_xy=True)
+    projected = shapely.transform(hb.geometry.to_numpy(),
+                                  lambda xy: np.column_stack(
+                                      forward.transform(xy[:, 0], xy[:, 1])))
+    centroid = shapely.centroid(projected)
+    lon, lat = inverse.transform(shapely.get_x(centroid),
+                                 shapely.get_y(centroid))
+    hb = gpd.GeoDataFrame({"id": hb["id"].to_numpy()},
+                          geometry=shapely.points(lon, lat), crs=4326)
+    os.makedirs(os.path.dirname(cache) or ".", exist_ok=True)
+    # the cache is shared by concurrent stages, so a half-written file is
+    # never visible under its final name; the part name is per process, so
+    # concurrent writers do not write the same file
+    part = f"{cache}.{os.getpid()}.part"
+    hb.to_parquet(part)
+    os.replace(part, cache)
+    return hb
+
+
+def prepare_house_blocks(filename: str) -> gpd.GeoDataFrame:
     """
-    hb = gpd.read_file(filename)
-    hb.to_crs(23700, inplace=True)
-    hb["geometry"] = hb.centroid
-    hb.to_crs(4326, inplace=True)
+    Load the house block centroids into a GeoDataFrame, and provides the \
+    location data in *lat* and *lon* columns required fo haversine calculation.
 
-    hb["point"] = np.array(zip(hb["geometry"].y, hb["geometry"].x))
+    :param filename: the path of the house block GeoJSON, the centroids are\
+        cached by :py:func:`load_centroids`
+    :return: GeoDataFrame with the lat and lon columns of the centroids
+    """
+    hb = load_centroids(filename)
+    hb["lat"] = hb["geometry"].y.to_numpy()
+    hb["lon"] = hb["geometry"].x.to_numpy()
     return hb
 
 
+def haversine_block(lat: np.ndarray, lon: np.ndarray, cos_lat: np.ndarray,
+                    start: int, stop: int, first: int,
+                    out: np.ndarray, buffer: np.ndarray) -> np.ndarray:
+    """
+    Calculate the haversine distances of a row block in place.
+
+    A fused version of ``haversine_vector(..., comb=True)``: the coordinates\
+    are converted to radians and the cosines of the latitudes are calculated\
+    once by the caller, and every intermediate result is written into the\
+    preallocated buffers, so no temporary matrix is allocated per row block.
+    The operations are the same as in haversine, so are the results.
+
+    :param lat: latitudes of the blocks in radians
+    :param lon: longitudes of the blocks in radians
+    :param cos_lat: cosines of the latitudes
+    :param start: index of the first source block
+    :param stop: index after the last source block
+    :param first: index of the first target block, the targets are the\
+        blocks from this index to the last one
+    :param out: output array, at least as large as sources times targets
+    :param buffer: scratch array, two times the shape of *out*
+
+    :return: view of *out* with the distances in kilometers, rows are the\
+        sources, columns are the targets
+
+    ###### Example
+    >>> lat, lon = np.radians([47.5, 47.6]), np.radians([19.0, 19.1])
+    >>> out, buffer = np.empty((2, 2)), np.empty((2, 2, 2))
+    >>> haversine_block(lat, lon, np.cos(lat), 0, 2, 0, out, buffer).round(3)
+    array([[ 0.   , 13.415],
+           [13.415,  0.   ]])
+    """
+    rows, columns = stop - start, len(lat) - first
+    d = buffer[0, :rows, :columns]
+    c = buffer[1, :rows, :columns]
+    out = out[:rows, :columns]
+    source, target = slice(start, stop), slice(first, None)
+    # sin(dlat / 2) ** 2
+    np.subtract(lat[source, None], lat[None, target], out=d)
+    np.multiply(d, 0.5, out=d)
+    np.sin(d, out=d)
+    np.square(d, out=d)
+    # cos(lat1) * cos(lat2) * sin(dlon / 2) ** 2, lat1 is the target
+    np.multiply(cos_lat[None, target], cos_lat[source, None], out=c)
+    np.subtract(lon[source, None], lon[None, target], out=out)
+    np.multiply(out, 0.5, out=out)
+    np.sin(out, out=out)
+    np.square(out, out=out)
+    np.multiply(c, out, out=c)
+    # R * 2 * asin(sqrt(d))
+    np.add(d, c, out=d)
+    np.sqrt(d, out=d)
+    np.arcsin(d, out=d)
+    np.multiply(d, 2, out=d)
+    return np.multiply(d, EARTH_RADIUS_KM, out=out)
+
+
+def init_worker(points: np.ndarray, ids: np.ndarray,
+                block_size: int) -> None:
+    """
+    Store the block centroids in the worker process.
+
+    Used as the initializer of the pool, so the centroids are sent to each\
+    worker only once instead of with every row block. The radians, the\
+    cosines of the latitudes and the buffers of :py:func:`haversine_block`\
+    are also prepared only once per worker.
+
+    :param points: (lat, lon) pairs of the block centroids
+    :param ids: block IDs in the order of the points
+    :param block_size: number of source blocks of a row block
+    """
+    global shared_ids
+    global shared_coordinates
+    global shared_buffers
+    lat, lon = np.radians(points[:, 0]), np.radians(points[:, 1])
+    shared_ids = ids
+    shared_coordinates = lat, lon, np.cos(lat)
+    shape = (min(block_size, len(ids)), len(ids))
+    shared_buffers = np.empty(shape), np.empty((2,) + shape)
+
+
+def mesh_block(start: int, stop: int, symmetric: bool = False
+               ) -> pd.DataFrame:
+    """
+    Calculate a row block of the mesh.
+
+    The blocks are read from the pool initialized by :py:func:`init_worker`.
+
+    :param start: index of the first source block of the row block
+    :param stop: index after the last source block of the row block
+    :param symmetric: if True, only the pairs with a target after the source\
+        are calculated
+
+    :return: the pairs of the row block
+    """
+    global shared_ids
+    global shared_coordinates
+    global shared_buffers
+    ids = shared_ids
+    # the targets before the block are the sources of earlier pairs
+    first = start if symmetric else 0
+    distance = haversine_block(*shared_coordinates, start, stop, first,
+                               *shared_buffers)
+    if symmetric:
+        i, j = np.nonzero(np.triu(np.ones(distance.shape, bool), 1))
+        distance = distance[i, j]
+    else:
+        i, j = np.divmod(np.arange(distance.size), len(ids))
+    return pd.DataFrame({
+        "source": ids[start + i],
+        "target": ids[first + j],
+        "distance_ij": np.round(distance, 3).ravel().astype(np.float32),
+        "p_i": np.int32(0),
+        "p_j": np.int32(0),
+    })
+
+
 def generate(output: str, hb: gpd.GeoDataFrame,
-             heartbeat: int = 1_000_000) -> None:
+             heartbeat: int = 1_000_000, block_size: int = 1024,
+             output_format: Literal["parquet", "csv"] = "parquet",
+             symmetric: bool = False, workers: Optional[int] = None) -> None:
     """
     Generate a full mesh network from house blocks and calculate the distance \
     between the block centroids.
 
-    The result is directly written into a file.
+    The result is directly written into a file. The distances are calculated\
+    by row blocks, i.e., from ``block_size`` source blocks to every target\
+    block at once, so the memory footprint is independent of the mesh size.
+    The row blocks are calculated by a process pool, and written in order by\
+    the main process, so the output is the same as a sequential run. At most\
+    two row blocks per worker are in flight, to bound the memory usage.
+
+    .. note::
+        The haversine distance is symmetric and it is zero for the self\
+        pairs. If *symmetric* is True, only the pairs with a source before\
+        the target (in the order of the blocks) are calculated and written,\
+        i.e., half of the mesh without the self pairs. The Parquet file is\
+        marked by the ``symmetric`` schema metadata, so\
+        :py:func:`add_movements_to_empty_mesh.read_mesh_chunks` restores the\
+        reverse pairs at reading, see :py:func:`mirror`.
 
-    :param output: the path of the output file (CSV)
+    :param output: the path of the output file
     :param hb: GeoDataFrame containing the house blocks
+    :param heartbeat: number of pairs between two log messages
+    :param block_size: number of source blocks processed at once
+    :param output_format: *parquet* writes the row blocks as row groups of a\
+        zstd compressed Parquet file with :py:data:`MESH_SCHEMA`, *csv*\
+        writes them as CSV lines
+    :param symmetric: if True, only one orientation of the pairs is written\
+        and the self pairs are skipped
+    :param workers: number of worker processes (default ``os.cpu_count()``)
     """
-    with open(output, "w") as fp:
-        print("source,target,distance_ij,p_i,p_j", file=fp)
-        temp = hb[["id", "point"]].copy()
+    ids = hb["id"].to_numpy(dtype=np.int32)
+    points = np.c_[hb["lat"].to_numpy(), hb["lon"].to_numpy()]
+    n = len(ids)
+    workers = workers or os.cpu_count() or 1
+    if output_format == "parquet":
+        schema = MESH_SCHEMA.with_metadata({"symmetric": "true"}) \
+            if symmetric else MESH_SCHEMA
+        writer = pq.ParquetWriter(output, schema, compression="zstd")
+    else:
+        writer = open(output, "w")
+        print(",".join(MESH_SCHEMA.names), file=writer)
+    with writer, ProcessPoolExecutor(max_workers=workers,
+                                     initializer=init_worker,
+                                     initargs=(points, ids, block_size)
+                                     ) as ex:
         k = 0
-        for i, j in product(temp.itertuples(), temp.itertuples()):
-            k += 1
-            distance = np.round(haversine(i.point, j.point,
-                                unit=Unit.KILOMETERS), 3)
-            print(f"{i.id},{j.id},{distance},0,0", file=fp)
-            if k % heartbeat == 0:
-                logger.info(f"heartbeat: {k}")
+        pending = deque()
+        for start in range(0, n, block_size):
+            pending.append(ex.submit(mesh_block, start,
+                                     min(start + block_size, n), symmetric))
+            # the oldest row block is written when the window is full,
+            # and all of them after the last one is submitted
+            while len(pending) >= 2 * workers or \
+                    (pending and start + block_size >= n):
+                block = pending.popleft().result()
+                write_block(writer, block)
+                pairs = k + len(block)
+                if pairs // heartbeat > k // heartbeat:
+                    logger.info(f"heartbeat: {pairs}")
+                k = pairs
+
+
+def write_block(writer: Union[pq.ParquetWriter, TextIO],
+                block: pd.DataFrame) -> None:
+    """
+    Write a row block of the mesh.
+
+    :param writer: Parquet writer with :py:data:`MESH_SCHEMA` or a CSV file
+    :param block: the pairs of the row block, see :py:func:`mesh_block`
+    """
+    if isinstance(writer, pq.ParquetWriter):
+        writer.write_table(pa.Table.from_pandas(
+            block, schema=MESH_SCHEMA, preserve_index=False))
+    else:
+        block.to_csv(writer, header=False, index=False)
+
+
+def mirror(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Add the reverse pairs to a part of a symmetric mesh.
+
+    :param df: mesh rows with one orientation of the pairs
+
+    :return: the rows followed by their reverse pairs
+
+    ###### Example
+    >>> mirror(pd.DataFrame({'source': [1, 1], 'target': [2, 3], \
+'distance_ij': [0.5, 1.5]}))
+       source  target  distance_ij
+    0       1       2          0.5
+    1       1       3          1.5
+    2       2       1          0.5
+    3       3       1          1.5
+    """
+    reverse = df.rename(columns={"source": "target", "target": "source"})
+    return pd.concat([df, reverse[df.columns]], ignore_index=True)
 
 
 if __name__ == "__main__":
@@ -65,13 +326,29 @@ if __name__ == "__main__":
         "--output",
         type=str,
         required=False,
-        default="output/mesh.csv",
+        default="output/mesh.parquet",
         help="result file")
+    parser.add_argument(
+        "--output-format",
+        type=str,
+        required=False,
+        default="parquet",
+        choices=["parquet", "csv"],
+        help="format of the result file")
+    parser.add_argument(
+        "--symmetric",
+        action="store_true",
+        help="write only one orientation of the pairs, without self pairs")
+    parser.add_argument(
+        "--pool",
+        type=int,
+        required=False,
+        help="number of worker processes (default: number of CPUs)")
     opts = parser.parse_args()
 
     if not exists(opts.output):
         hb = prepare_house_blocks(opts.blocks)
-        # runs 24m
-        generate(opts.output, hb)
+        generate(opts.output, hb, output_format=opts.output_format,
+                 symmetric=opts.symmetric, workers=opts.pool)
     else:
         logger.info(f"{opts.output} exists, exiting.")
@@ -16,6 +16,7 @@ to produce a single polygon, and extracts the waterway as a LineString.
 import geopandas as gpd
 import osmnx as ox
 from osmnx.geometries import geometries_from_polygon
+from get_roads import union_by
 
 ox.settings.use_cache = True
 ox.settings.log_console = False
@@ -43,10 +44,7 @@ def union_by_name(gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
     >>> u[u["name"] == "flod"].at[0, "geometry"].length == l1.length+l2.length
     True
     """
-    tmp = gdf[gdf["geometry"].type == "LineString"]
-    result =  tmp.groupby("name").apply(lambda x: x.unary_union).reset_index()
-    result.columns = ["name", "geometry"]
-    return gpd.GeoDataFrame(result)
+    return union_by(gdf[gdf["geometry"].type == "LineString"], "name")
 
 
 if __name__ == "__main__":
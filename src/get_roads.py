@@ -1,7 +1,10 @@
+import os
+import numpy as np
+import pandas as pd
 import geopandas as gpd
+import shapely
 import osmnx as ox
 from pyogrio.errors import DataSourceError
-from fiona.errors import DriverError
 
 ox.settings.use_cache = True
 ox.settings.log_console = False
@@ -36,13 +39,50 @@ def filter_roads(roads: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
 
 def save_roads_by_type(filtered_roads: gpd.GeoDataFrame, path: str) -> None:
     filtered_roads.query("highway.isin(['motorway'])")\
-        .to_file(f"{path}/filtered_roads_m.geojson", driver="GeoJSON")
+        .to_parquet(f"{path}/filtered_roads_m.parquet")
     filtered_roads.query("highway.isin(['primary'])")\
-        .to_file(f"{path}/filtered_roads_p.geojson", driver="GeoJSON")
+        .to_parquet(f"{path}/filtered_roads_p.parquet")
     filtered_roads.query("highway.isin(['secondary'])")\
-        .to_file(f"{path}/filtered_roads_s.geojson", driver="GeoJSON")
+        .to_parquet(f"{path}/filtered_roads_s.parquet")
     filtered_roads.query("highway.isin(['motorway', 'primary'])")\
-        .to_file(f"{path}/filtered_roads_mp.geojson", driver="GeoJSON")
+        .to_parquet(f"{path}/filtered_roads_mp.parquet")
+
+
+def union_by(gdf: gpd.GeoDataFrame, column: str) -> gpd.GeoDataFrame:
+    """
+    Apply unary union to the geometries grouped by a column.
+
+    The geometries are sorted by the group codes and split at the group\
+    boundaries, so the unions are called on the geometry arrays directly,\
+    without a groupby-apply and a GeoDataFrame slice per group.
+
+    :param gdf: GeoDataFrame with the geometries to union
+    :param column: name of the column to group by
+
+    :return: GeoDataFrame with two columns (the column and the geometry),\
+        sorted by the column. Rows with missing values in the column are\
+        dropped, as by groupby.
+
+    ###### Example
+    >>> from shapely import LineString
+    >>> gdf = gpd.GeoDataFrame({"name": ["b", "a", "b", None], "geometry": [\
+LineString([(0, 0), (1, 0)]), LineString([(0, 1), (1, 1)]), \
+LineString([(1, 0), (2, 1)]), LineString([(5, 5), (6, 6)])]})
+    >>> union_by(gdf, "name")
+      name                                  geometry
+    0    a                     LINESTRING (0 1, 1 1)
+    1    b  MULTILINESTRING ((0 0, 1 0), (1 0, 2 1))
+    """
+    codes, names = pd.factorize(gdf[column], sort=True)
+    geoms = gdf.geometry.to_numpy()[codes >= 0]
+    codes = codes[codes >= 0]
+    order = np.argsort(codes, kind="stable")
+    bounds = np.flatnonzero(np.diff(codes[order])) + 1
+    return gpd.GeoDataFrame({
+        column: names,
+        "geometry": [shapely.unary_union(g)
+                     for g in np.split(geoms[order], bounds)]
+    }, crs=gdf.crs)
 
 
 def union_by_road_name(
@@ -59,19 +99,38 @@ def union_by_road_name(
     :return: a GeoDataFrame with two columns (road name and the geometry).\
         The geometry can be a MultiLineString.
     """
-    result = gdf[gdf["highway"].isin(highway)]\
-        .groupby("name").apply(lambda x: x.unary_union).reset_index()
-    result.columns = ["name", "geometry"]
-    return gpd.GeoDataFrame(result)
+    return union_by(gdf[gdf["highway"].isin(highway)], "name")
+
+
+def read_geodata(stem: str) -> gpd.GeoDataFrame:
+    """
+    Read a GeoParquet output, or the GeoJSON written by earlier versions.
+
+    :param stem: path without extension, e.g., *output/roads/railways*
+
+    :return: the data of *stem.parquet* if exists, otherwise of\
+        *stem.geojson*
+
+    :raises FileNotFoundError: if neither of them exists
+    :raises pyogrio.errors.DataSourceError: if the GeoJSON cannot be read
+    """
+    if os.path.exists(f"{stem}.parquet"):
+        return gpd.read_parquet(f"{stem}.parquet")
+    if os.path.exists(f"{stem}.geojson"):
+        return gpd.read_file(f"{stem}.geojson", engine="pyogrio",
+                             use_arrow=True)
+    raise FileNotFoundError(
+        f"neither {stem}.parquet nor {stem}.geojson exists")
 
 
 def get_roads(area: gpd.GeoDataFrame, output: str) -> gpd.GeoDataFrame:
     """
     Download roads from OSM using OSMnX.
 
-    If the roads are already downloaded it reads from the disk, otherwise\
-        downloads the OSM highway type elements from OpenStreetMap and saves\
-        the data to the output folder as a GeoJSON.
+    If the roads are already downloaded it reads from the disk (GeoParquet,\
+        or the GeoJSON of earlier versions), otherwise downloads the OSM\
+        highway type elements from OpenStreetMap and saves the data to the\
+        output folder as a GeoParquet.
 
     :param area: the area within the roads will be downloaded
     :param output: output folder
@@ -79,7 +138,7 @@ def get_roads(area: gpd.GeoDataFrame, output: str) -> gpd.GeoDataFrame:
     :return: roads as GeoDataFrame
     """
     try:
-        roads = gpd.read_file(f"{output}/roads.geojson", engine="pyogrio")
+        roads = read_geodata(f"{output}/roads")
     except (FileNotFoundError, DataSourceError):
         # runs about 5m
         g = ox.graph_from_polygon(
@@ -88,7 +147,7 @@ def get_roads(area: gpd.GeoDataFrame, output: str) -> gpd.GeoDataFrame:
             simplify=False
         )
         roads = ox.graph_to_gdfs(g, nodes=False)
-        roads.to_file(f"{output}/roads.geojson", driver="GeoJSON")
+        roads.to_parquet(f"{output}/roads.parquet")
     return roads
 
 
@@ -96,9 +155,10 @@ def get_railways(area: gpd.GeoDataFrame, output: str) -> gpd.GeoDataFrame:
     """
     Download railways from OSM using OSMnX.
 
-    If the railways are already downloaded it reads from the disk, otherwise\
-        downloads railways from OSM with 'rail' or 'light_rail' types elements\
-        and saves the data to the output folder as a GeoJSON.
+    If the railways are already downloaded it reads from the disk\
+        (GeoParquet, or the GeoJSON of earlier versions), otherwise downloads\
+        railways from OSM with 'rail' or 'light_rail' types elements and\
+        saves the data to the output folder as a GeoParquet.
 
     .. note::
         OSM raileays types such as *spur*, *yard* and *siding* are excluded.
@@ -109,8 +169,8 @@ def get_railways(area: gpd.GeoDataFrame, output: str) -> gpd.GeoDataFrame:
     :return: railways as GeoDataFrame
     """
     try:
-        rgdf = gpd.read_file(f"{output}/railways.geojson")
-    except (FileNotFoundError, DataSourceError, DriverError):
+        rgdf = read_geodata(f"{output}/railways")
+    except (FileNotFoundError, DataSourceError):
         opts_railway = ["rail", "light_rail"]
         opts_excluding_railway_service = ["spur", "yard", "siding"]
         rail_filter = f'["railway"~"({"|".join(opts_railway)})"]["service"!~"{"|".join(opts_excluding_railway_service)}"]'
@@ -122,12 +182,9 @@ def get_railways(area: gpd.GeoDataFrame, output: str) -> gpd.GeoDataFrame:
         )
         railways = ox.graph_to_gdfs(g_rw, nodes=False)
 
-        rgdf = railways.groupby("ref")\
-            .apply(lambda x: x.unary_union).reset_index()
-        rgdf.columns = ["ref", "geometry"]
-        rgdf = gpd.GeoDataFrame(rgdf, crs=4326)
+        rgdf = union_by(railways, "ref")
 
-        rgdf.to_file(f"{opts.output}/railways.geojson", driver="GeoJSON")
+        rgdf.to_parquet(f"{output}/railways.parquet")
 
     return rgdf
 
@@ -135,6 +192,7 @@ def get_railways(area: gpd.GeoDataFrame, output: str) -> gpd.GeoDataFrame:
 if __name__ == "__main__":
     import argparse
     from pathlib import Path
+    from concurrent.futures import ThreadPoolExecutor
 
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -152,27 +210,32 @@ if __name__ == "__main__":
     opts = parser.parse_args()
     Path(opts.output).mkdir(parents=True, exist_ok=True)
 
-    area = gpd.read_file(opts.area)
+    area = gpd.read_file(opts.area, engine="pyogrio", use_arrow=True)
 
     roads = get_roads(area, opts.output)
 
     filtered = filter_roads(roads)
-    if not Path(f"{opts.output}/filtered_roads.geojson").exists():
-        filtered.to_file(f"{opts.output}/filtered_roads.geojson",
-                         driver="GeoJSON")
+    if not Path(f"{opts.output}/filtered_roads.parquet").exists():
+        filtered.to_parquet(f"{opts.output}/filtered_roads.parquet")
 
     save_roads_by_type(filtered, opts.output)
 
-    name_unioned_p = union_by_road_name(filtered, ["primary"])
-    name_unioned_p.to_file(f"{opts.output}/name_unioned_roads_p.geojson",
-                           driver="GeoJSON")
-
-    name_unioned_mp = union_by_road_name(filtered, ["motorway", "primary"])
-    name_unioned_mp.to_file(f"{opts.output}/name_unioned_roads_mp.geojson",
-                            driver="GeoJSON")
-
-    name_unioned_s = union_by_road_name(filtered, ["secondary"])
-    name_unioned_s.to_file(f"{opts.output}/name_unioned_roads_s.geojson",
-                           driver="GeoJSON")
+    # the primary roads are part of two outputs, so the roads are unioned
+    # once per highway type, and the motorway and primary unions are unioned
+    # by name again, which is cheap as they are already merged
+    per_type = {h: union_by_road_name(filtered, [h])
+                for h in ["motorway", "primary", "secondary"]}
+    name_unioned = {
+        "p": per_type["primary"],
+        "mp": union_by(pd.concat([per_type["motorway"], per_type["primary"]]),
+                       "name"),
+        "s": per_type["secondary"],
+    }
+    # pyarrow releases the GIL while writing, so threads are enough
+    with ThreadPoolExecutor() as ex:
+        list(ex.map(
+            lambda x: x[1].to_parquet(
+                f"{opts.output}/name_unioned_roads_{x[0]}.parquet"),
+            name_unioned.items()))
 
     _ = get_railways(area, opts.output)
@@ -1,4 +1,4 @@
-using Dates, CSV, DataFrames, GLM, RegressionTables, FixedEffectModels, ArgParse
+using Dates, CSV, Parquet2, DataFrames, GLM, RegressionTables, FixedEffectModels, ArgParse
 
 function save_model_tables(models, filename)
     regtable(models...; renderSettings = asciiOutput("$(filename).txt"))
@@ -13,7 +13,15 @@ end;
 
 function read_mesh(path; columns=nothing)
     println("start loading mesh")
-    df = DataFrame(CSV.File("$(path)"; select=columns, types=Float64))
+    if endswith(path, ".parquet")
+        df = DataFrame(Parquet2.Dataset("$(path)"); copycols=false)
+        if !isnothing(columns)
+            select!(df, columns)
+        end
+        mapcols!(c -> Float64.(c), df)
+    else
+        df = DataFrame(CSV.File("$(path)"; select=columns, types=Float64))
+    end
     println("mesh loaded")
 
     filter!(row -> row[:source] != row[:target], df)
@@ -106,7 +114,7 @@ function parse_commandline()
     @add_arg_table! s begin
         "--mesh"
             help = "path for enriched mesh"
-            default = "output/mesh_final.csv"
+            default = "output/mesh_final.parquet"
         "--output"
             help = "output directory"
             default = "output/ols"
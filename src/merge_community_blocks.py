@@ -1,27 +1,132 @@
+import os
+import numpy as np
 import pandas as pd
 import geopandas as gpd
 import pathlib
+import shapely
 from shapely.geometry import Polygon, MultiPolygon
+from typing import Optional
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
 
 
-def get_the_largest_set_of_community(
-    gdf: gpd.GeoDataFrame, community: gpd.GeoSeries
-) -> Polygon:
-    extended = gdf.copy()
-    extended = extended.query("community==@community")
-    dissolved = extended.dissolve()
-    if isinstance(dissolved.geometry[0], Polygon):
-        return dissolved.geometry[0]
-    largest = max(list(dissolved.geometry[0].geoms), key=lambda x: x.area)
-    return Polygon(largest.exterior.coords)
+def get_the_largest_polygon(g: shapely.Geometry) -> Optional[Polygon]:
+    """
+    Get the largest polygon of a geometry.
 
+    The areas of the parts are calculated in one vectorized call, and the\
+    largest part is returned as it is, with its holes.
 
-def get_the_largest_community_polygon(gdf: gpd.GeoDataFrame) -> Polygon:
-    g = gdf.to_crs(23700).dissolve().geometry[0]
+    :param g: a Polygon or a MultiPolygon
+    :return: the Polygon itself, or the largest part of the MultiPolygon,\
+        None for other geometry types
+
+    ###### Example
+    >>> get_the_largest_polygon(shapely.box(0, 0, 1, 1))
+    <POLYGON ((1 0, 1 1, 0 1, 0 0, 1 0))>
+    >>> get_the_largest_polygon(shapely.MultiPolygon(\
+[shapely.box(0, 0, 1, 1), shapely.box(2, 0, 4, 2)]))
+    <POLYGON ((4 0, 4 2, 2 2, 2 0, 4 0))>
+    >>> get_the_largest_polygon(shapely.MultiPolygon([shapely.box(0, 0, 1, 1), \
+shapely.box(2, 0, 5, 3).difference(shapely.box(3, 1, 4, 2))]))
+    <POLYGON ((2 0, 2 3, 5 3, 5 0, 2 0), (4 2, 3 2, 3 1, 4 1, 4 2))>
+    """
     if isinstance(g, Polygon):
         return g
     elif isinstance(g, MultiPolygon):
-        return Polygon(max(g.geoms, key=lambda x: x.area).exterior.coords)
+        parts = shapely.get_parts(g)
+        return parts[np.argmax(shapely.area(parts))]
+
+
+def group_positions(codes: np.ndarray, n: int) -> list[np.ndarray]:
+    """
+    Group the positions of an array by their codes.
+
+    :param codes: group codes of the positions, -1 means no group
+    :param n: number of groups
+
+    :return: positions per group, in ascending order
+
+    ###### Example
+    >>> group_positions(np.array([1, 0, -1, 1]), 3)
+    [array([1]), array([0, 3]), array([], dtype=int64)]
+    """
+    order = np.argsort(codes, kind="stable")
+    order = order[codes[order] >= 0]
+    bounds = np.searchsorted(codes[order], np.arange(n + 1))
+    return [order[bounds[k]:bounds[k + 1]] for k in range(n)]
+
+
+def merge_communities(hb: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+    """
+    Merge the blocks of the communities into polygons.
+
+    The blocks of a community are unioned, and the largest polygon of the\
+    union is taken as the area of the community. Then the blocks within that\
+    area are unioned in EPSG:23700, and the largest polygon of this is the\
+    merged community. Blocks in the holes of the area are not within it.
+
+    The community unions are calculated once on the grouped geometry arrays\
+    and the blocks within the areas are searched by a spatial index built\
+    once, instead of a scan of all blocks per community.
+
+    :param hb: blocks in EPSG:4326 with their *community*
+
+    :return: merged communities with *id* and *geometry* in EPSG:23700, in\
+        the order of the first appearance of the communities
+    """
+    communities = hb["community"].dropna().unique()
+    codes = pd.Index(communities).get_indexer(hb["community"])
+    geoms = hb.geometry.to_numpy()
+    areas = [
+        get_the_largest_polygon(shapely.unary_union(geoms[positions]))
+        for positions in group_positions(codes, len(communities))
+    ]
+
+    # a block is within an area if the area contains it
+    area_idx, block_idx = shapely.STRtree(geoms).query(areas,
+                                                       predicate="contains")
+    projected = hb.geometry.to_crs(23700).to_numpy()
+    polygons = [
+        get_the_largest_polygon(
+            shapely.unary_union(projected[np.sort(block_idx[positions])]))
+        for positions in group_positions(area_idx, len(areas))
+    ]
+    return gpd.GeoDataFrame({"id": communities, "geometry": polygons},
+                            geometry="geometry", crs=23700)
+
+
+def process_run(run: int, path: str, resolution: float,
+                start_date: str, end_date: str) -> int:
+    """
+    Merge the community blocks of a run and save them as GeoJSON.
+
+    :param run: the run of the community detection
+    :param path: directory of the runs, e.g.,\
+        ``../output/place_communities/louvain``
+    :param resolution: louvain resolution parameter
+    :param start_date: start date of the place connections
+    :param end_date: end date of the place connections
+
+    :return: the run
+
+    .. note::
+        The annotated blocks are read from GeoParquet if it exists,\
+        otherwise from GeoJSON.
+    """
+    pathlib.Path(f"{path}/{run}/").mkdir(parents=True, exist_ok=True)
+
+    filename = f"{path}/{run}/{start_date}_{end_date}_resolution{resolution}"
+    if pathlib.Path(f"{filename}.parquet").exists():
+        hb = gpd.read_parquet(f"{filename}.parquet")
+    else:
+        hb = gpd.read_file(f"{filename}.geojson", engine="pyogrio",
+                           use_arrow=True)
+
+    communities = merge_communities(hb)
+    communities.to_file(f"{path}/{run}/louvain_r{resolution}_merged.geojson",
+                        driver="GeoJSON", engine="pyogrio")
+    return run
 
 
 if __name__ == "__main__":
@@ -45,29 +150,18 @@ if __name__ == "__main__":
                            default=0)
     argparser.add_argument("--run-stop", type=int, required=False,
                            default=10, help="excluded")
+    argparser.add_argument("--pool", type=int, required=False,
+                           help="number of runs processed in parallel")
     opts = argparser.parse_args()
 
-    for run in range(opts.run_start, opts.run_stop):
-        pathlib.Path(f"{opts.output}/{opts.target}/"
-                     f"{opts.communities}/louvain/{run}/")\
-            .mkdir(parents=True, exist_ok=True)
-
-        hb = gpd.read_file(f"{opts.output}/{opts.target}/"
-                           f"{opts.communities}/louvain/{run}/"
-                           f"{opts.start_date}_{opts.end_date}"
-                           f"_resolution{opts.resolution}.geojson")
-
-        c = []
-        for i in hb["community"].dropna().unique():
-            area = get_the_largest_set_of_community(hb, i)
-            p = get_the_largest_community_polygon(
-                hb[hb["geometry"].within(area)])
-            c.append([i, p])
-
-        communities = gpd.GeoDataFrame(
-            pd.DataFrame.from_records(c, columns=["id", "geometry"]),
-            geometry="geometry", crs=23700)
-        communities.to_file(f"{opts.output}/"
-                            f"{opts.target}/{opts.communities}/louvain/{run}/"
-                            f"louvain_r{opts.resolution}_merged.geojson",
-                            driver="GeoJSON")
+    path = f"{opts.output}/{opts.target}/{opts.communities}/louvain"
+    runs = range(opts.run_start, opts.run_stop)
+    # the runs are independent files, so they are processed in parallel
+    with ProcessPoolExecutor(
+        max_workers=opts.pool or min(os.cpu_count() or 1, len(runs) or 1)
+    ) as ex:
+        for run in ex.map(partial(process_run, path=path,
+                                  resolution=opts.resolution,
+                                  start_date=opts.start_date,
+                                  end_date=opts.end_date), runs):
+            print(f"run {run} merged")
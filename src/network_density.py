@@ -1,9 +1,36 @@
-import networkx as nx
+import numpy as np
+import pandas as pd
 import yaml
 
 
-def density(g: nx.Graph, output: str) -> None:
-    d = nx.density(g)
+def edgelist_density(path: str) -> float:
+    """
+    Calculate the density of an undirected network stored as edgelist.
+
+    The density is ``2m / (n(n - 1))``, so only the number of nodes and the\
+    number of edges are needed. They are counted on the node columns read\
+    by pandas, without building a NetworkX graph. The nodes are compared as\
+    strings and reversed duplicate edges are counted once, as by\
+    ``nx.density(nx.read_edgelist(path))``.
+
+    :param path: path of the edgelist, written by ``nx.write_edgelist``
+
+    :return: density of the network
+    """
+    df = pd.read_csv(path, sep=" ", header=None, usecols=[0, 1], dtype=str)
+    codes, nodes = pd.factorize(df.to_numpy().ravel())
+    n = len(nodes)
+    if n <= 1:
+        return 0
+    u, v = codes[0::2].astype(np.int64), codes[1::2].astype(np.int64)
+    m = len(np.unique(np.minimum(u, v) * n + np.maximum(u, v)))
+    # the same operations as nx.density, so the result is the same float
+    d = m / (n * (n - 1))
+    return d * 2
+
+
+def density(path: str, output: str) -> None:
+    d = edgelist_density(path)
     with open(output, "w") as fp:
         yaml.dump({"density": d}, fp)
 
@@ -38,6 +65,4 @@ if __name__ == "__main__":
 
     Path(opts.output).mkdir(parents=True, exist_ok=True)
 
-    g = nx.read_edgelist(opts.network)
-
-    density(g, f"{opts.output}/{opts.filename}.yaml")
\ No newline at end of file
+    density(opts.network, f"{opts.output}/{opts.filename}.yaml")
@@ -6,76 +6,229 @@ $$
 $$
 """
 from pathlib import Path
+import os
+import re
 import logging
 import sys
 import json
+import numpy as np
 import pandas as pd
+import pyarrow.csv as pv
 import matplotlib.pyplot as plt
-import seaborn as sns
 from typing import Optional
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
 
 logger = logging.Logger("null model")
 logging.basicConfig(stream=sys.stdout, level=logging.INFO)
 
 
+def barrier_type(barrier: pd.Series) -> pd.Series:
+    """
+    Strip the suffix of the barrier names, e.g., *road1_count* to *road1*.
+
+    The names are repeated in every row, so only the distinct names are\
+    split, then the results are gathered by the factorized codes.
+
+    :param barrier: barrier names
+
+    :return: barrier types with the same index
+
+    ###### Example
+    >>> barrier_type(pd.Series(["road1_count", "river_x", "road1_count"]))\
+        .tolist()
+    ['road1', 'river', 'road1']
+    """
+    codes, names = pd.factorize(barrier)
+    types = np.array([name.split("_")[0] for name in names], dtype=object)
+    return pd.Series(types[codes], index=barrier.index, name=barrier.name)
+
+
+def read_cached_csv(filename: str,
+                    columns: Optional[list[str]] = None) -> pd.DataFrame:
+    """
+    Read a CSV through a Parquet cache.
+
+    The CSV is parsed only once by the pyarrow CSV reader, which detects the\
+    gzip compression by the extension, then it is cached next to it as Parquet\
+    (e.g., ``road1.csv.gz`` as ``road1.parquet``), which is read without\
+    decompressing and tokenizing the text. The cache is rebuilt if the CSV\
+    is newer.
+
+    :param filename: path of the CSV, optionally gzipped
+    :param columns: columns to return, all by default
+
+    :return: the CSV as DataFrame with pyarrow backed columns
+    """
+    cache = re.sub(r"\.csv(\.gz)?$", ".parquet", filename)
+    if os.path.exists(cache) and \
+            os.path.getmtime(cache) >= os.path.getmtime(filename):
+        return pd.read_parquet(cache, columns=columns,
+                               dtype_backend="pyarrow")
+
+    # pyarrow decompresses and parses the CSV in C++ with multiple threads,
+    # and the columns are kept in Arrow buffers
+    df = pv.read_csv(filename).to_pandas(types_mapper=pd.ArrowDtype)
+    # an interrupted write does not leave an incomplete cache behind
+    df.to_parquet(f"{cache}.part", engine="pyarrow", compression="zstd")
+    os.replace(f"{cache}.part", cache)
+    return df if columns is None else df[columns]
+
+
+def categorize(df: pd.DataFrame, barriers: list[str],
+               networks: Optional[list[str]] = None) -> pd.DataFrame:
+    """
+    Cast the *barrier* and *network* columns to categorical.
+
+    The frames are filtered, grouped and merged by these columns, so integer\
+    codes are compared instead of strings. The categories are given, so the\
+    frames share the same dtypes and are merged on the codes.
+
+    :param df: DataFrame with a *barrier* and optionally a *network* column
+    :param barriers: the barrier types, other values become missing
+    :param networks: the network IDs, the *network* column is kept as it is\
+        if not given
+
+    :return: the DataFrame with the categorical columns
+
+    ###### Example
+    >>> categorize(pd.DataFrame({"barrier": ["river", "road1"]}),
+    ...            ["road1", "river"])["barrier"].cat.codes.tolist()
+    [1, 0]
+    """
+    dtypes = {"barrier": pd.CategoricalDtype(barriers)}
+    if networks is not None and "network" in df:
+        dtypes["network"] = pd.CategoricalDtype(networks)
+    return df.astype(dtypes)
+
+
+def read_community_crossing(path: str, network: str) -> pd.DataFrame:
+    """
+    Read the inter community crossings of a network.
+
+    :param path: directory of the community crossings
+    :param network: network ID
+
+    :return: the *res*, *barrier* and *count* columns of the crossings with\
+        a *network* column
+    """
+    t = read_cached_csv(f"{path}/{network}/inter.csv",
+                        columns=["res", "barrier", "count"])
+    t["network"] = network
+    return t
+
+
+def group_mean(df: pd.DataFrame, by: list[str],
+               column: str) -> pd.DataFrame:
+    """
+    Average a column by groups, as ``df.groupby(by)[column].mean()``.
+
+    The keys are factorized in sorted order and packed into one integer\
+    key, then the sums and the sizes of the groups are counted by\
+    ``np.bincount``. The groups are in the sorted order of the keys, and\
+    rows with missing keys are dropped, as by groupby.
+
+    :param df: the data
+    :param by: the key columns
+    :param column: the column to average
+
+    :return: the keys and the mean of the column per group
+
+    ###### Example
+    >>> df = pd.DataFrame({"res": [2.0, 1.0, 2.0, 1.0],
+    ...                    "barrier": list("abba"), "count": [1, 2, 3, 4]})
+    >>> group_mean(df, ["res", "barrier"], "count")
+       res barrier  count
+    0  1.0       a    4.0
+    1  1.0       b    2.0
+    2  2.0       a    1.0
+    3  2.0       b    3.0
+    """
+    key = np.zeros(len(df), dtype=np.int64)
+    valid = np.ones(len(df), dtype=bool)
+    levels = []
+    for c in by:
+        codes, uniques = pd.factorize(df[c], sort=True)
+        key = key * len(uniques) + codes
+        valid &= codes >= 0
+        levels.append(uniques)
+    key = key[valid]
+    sums = np.bincount(key, weights=df[column].to_numpy()[valid])
+    sizes = np.bincount(key)
+    groups = np.flatnonzero(sizes)
+    # the packed keys are unpacked to the codes of the key columns
+    codes = np.unravel_index(groups, [len(u) for u in levels])
+    return pd.DataFrame({c: u[code] for c, u, code in zip(by, levels, codes)}
+                        | {column: sums[groups] / sizes[groups]})
+
+
 def read_cross_community_data(
     networks: list[str],
     path: str,
-    groupby: list[str] = ["res", "barrier"]
+    groupby: list[str] = ["res", "barrier"],
+    workers: Optional[int] = None
 ) -> pd.DataFrame:
-    cc_cfg_raw = pd.DataFrame()
-    for network in networks:
-        t = pd.read_csv(f"{path}/{network}/inter.csv")
-        t["network"] = network
-        cc_cfg_raw = pd.concat([cc_cfg_raw, t])
-
-    cc_cfg = cc_cfg_raw.groupby(groupby)["count"].mean().reset_index()
-    cc_cfg["barrier"] = cc_cfg["barrier"].apply(lambda x: x.split("_")[0])
-    return cc_cfg
+    # the files are independent, so they are read by a process pool, and the
+    # frames are concatenated once
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        frames = list(ex.map(partial(read_community_crossing, path), networks,
+                             chunksize=8))
+    cc_cfg_raw = pd.concat(frames, ignore_index=True)
+
+    cc_cfg = group_mean(cc_cfg_raw, groupby, "count")
+    cc_cfg["barrier"] = barrier_type(cc_cfg["barrier"])
+    return categorize(cc_cfg, cc_cfg["barrier"].unique().tolist(), networks)
 
 
 def merge_eq_parts(
     bc_obs: dict,
     bc_cfg: pd.DataFrame,
     cc_obs: pd.DataFrame,
-    cc_cfg: pd.DataFrame,
-    barrier: str
-) -> pd.DataFrame:
-    qrb = cc_cfg[cc_cfg["barrier"] == barrier][["res", "network", "count"]]\
-        .reset_index(drop=True)
-    qrb.columns = ["res", "network", "cc_cfg"]
-    qru = cc_obs[cc_obs["barrier"] == barrier].groupby("res")["count"].mean()\
-        .reset_index()
-    qru.columns = ["res", "cc_obs"]
-
-    qrx = bc_cfg[bc_cfg["barrier"] == barrier][["network", "count"]]\
-        .reset_index(drop=True)
-    qrx.columns = ["network", "bc_cfg"]
-    q = qrb.merge(qru, on="res").merge(qrx, on="network")
-
-    q["bc_obs"] = bc_obs[barrier]["count"].mean()
-    q = calculate_crossing_ratio(q)
-    q = calculate_alternative_crossing_ratio(q)
-
-    return q
-
-
-def calculate_crossing_ratio(x: pd.DataFrame) -> pd.DataFrame:
-    y = x.copy()
-    y["bc_ratio"] = y["bc_obs"] / y["bc_cfg"]
-
-    y["cc_ratio"] = (y["cc_obs"] / y["cc_cfg"])
-    y["pi"] = y["bc_ratio"] / y["cc_ratio"]
-
-    return y
-
-def calculate_alternative_crossing_ratio(x: pd.DataFrame) -> pd.DataFrame:
-    y = x.copy()
-    y["obs_ratio"] = y["bc_obs"] / y["cc_obs"]
-    y["cfg_ratio"] = y["bc_cfg"] / y["cc_cfg"]
-    y["pi2"] = y["obs_ratio"] / y["cfg_ratio"]
-
-    return y
+    cc_cfg: pd.DataFrame
+) -> dict[str, pd.DataFrame]:
+    """
+    Merge the parts of the equation and calculate the ratios per barrier.
+
+    All barriers are merged at once on the barrier and the resolution or the\
+    network, instead of filtering and merging the frames per barrier.
+
+    :param bc_obs: observed barrier crossings per barrier
+    :param bc_cfg: mean barrier crossings of the rewired networks
+    :param cc_obs: observed community crossings
+    :param cc_cfg: mean community crossings of the rewired networks
+
+    :return: the merged parts and the ratios per barrier, in the order of\
+        *cc_cfg*
+    """
+    qrb = cc_cfg[["barrier", "res", "network", "count"]]\
+        .rename(columns={"count": "cc_cfg"})
+    qru = cc_obs.groupby(["barrier", "res"], observed=True)["count"].mean()\
+        .rename("cc_obs").reset_index()
+    qrx = bc_cfg[["barrier", "network", "count"]]\
+        .rename(columns={"count": "bc_cfg"})
+    q = qrb.merge(qru, on=["barrier", "res"])\
+        .merge(qrx, on=["barrier", "network"])
+
+    # the ratios are calculated on the arrays and assigned at once, instead
+    # of copying the DataFrame for each group of ratios
+    bc_obs_mean = q["barrier"].map(
+        {barrier: t["count"].mean() for barrier, t in bc_obs.items()})\
+        .to_numpy()
+    cc_obs_count = q["cc_obs"].to_numpy()
+    cc_cfg_count = q["cc_cfg"].to_numpy()
+    bc_cfg_count = q["bc_cfg"].to_numpy()
+    bc_ratio = bc_obs_mean / bc_cfg_count
+    cc_ratio = cc_obs_count / cc_cfg_count
+    obs_ratio = bc_obs_mean / cc_obs_count
+    cfg_ratio = bc_cfg_count / cc_cfg_count
+    q = q.assign(bc_obs=bc_obs_mean,
+                 bc_ratio=bc_ratio, cc_ratio=cc_ratio,
+                 pi=bc_ratio / cc_ratio,
+                 obs_ratio=obs_ratio, cfg_ratio=cfg_ratio,
+                 pi2=obs_ratio / cfg_ratio)
+    return {barrier: part.drop(columns="barrier").reset_index(drop=True)
+            for barrier, part in q.groupby("barrier", sort=False,
+                                           observed=True)}
 
 
 def plot_single(
@@ -83,17 +236,35 @@ def plot_single(
     axes: Optional[plt.Axes] = None,
     figsize: tuple[int, int] = (5, 5)
 ) -> tuple[plt.Figure, plt.Axes]:
-    fig, ax = plt.subplots(figsize=figsize)
-    if axes:
+    """
+    Plot the mean Pi of the rewired networks by resolution.
+
+    The means and their 95% confidence intervals are aggregated once by\
+    pandas, and the band uses the normal approximation instead of the\
+    bootstrap of ``seaborn.lineplot``.
+
+    :param df: merged equation parts of a barrier, see\
+        :py:func:`merge_eq_parts`
+    :param axes: axes to plot on, a new figure is created if not given
+    :param figsize: size of the new figure
+
+    :return: the figure and the axes
+    """
+    if axes is None:
+        fig, ax = plt.subplots(figsize=figsize)
+    else:
         ax = axes
         fig = axes.get_figure()
 
-    sns.lineplot(
-        x="res",
-        y="pi",
-        data=df[["res", "network", "pi"]],
-        ax=ax
-    )
+    agg = df.groupby("res")["pi"].agg(["mean", "sem"])
+    res = agg.index.to_numpy(dtype=np.float64)
+    mean = agg["mean"].to_numpy(dtype=np.float64)
+    error = 1.96 * agg["sem"].to_numpy(dtype=np.float64, na_value=0)
+    line, = ax.plot(res, mean)
+    ax.fill_between(res, mean - error, mean + error,
+                    color=line.get_color(), alpha=0.2, linewidth=0)
+    ax.set_xlabel("res")
+    ax.set_ylabel("pi")
 
     return fig, ax
 
@@ -159,21 +330,45 @@ def get_random_networks_barrier_crossing(
     return bc_cfg
 
 
+def read_barrier_crossing(
+    barrier_crossing_dir: str,
+    barrier: str,
+    network: str
+) -> pd.DataFrame:
+    """
+    Read the barrier crossings of a network and average them.
+
+    :param barrier_crossing_dir: directory of the barrier crossings
+    :param barrier: barrier type, e.g., *road1*
+    :param network: network ID
+
+    :return: one row with the *network*, the mean *count* and the *barrier*
+    """
+    # only the counts are read, and the file is a single group, so the mean
+    # is calculated directly
+    t = read_cached_csv(f"{barrier_crossing_dir}/{network}/{barrier}.csv.gz",
+                        columns=["count"])
+    mean = t["count"].to_numpy(dtype="float64").mean()
+    return pd.DataFrame({"network": [network], "count": [mean],
+                         "barrier": [barrier]})
+
+
 def read_cross_barrier_data(
     rewired_networks: list[str],
     barriers: list[str],
-    barrier_crossing_dir: str
+    barrier_crossing_dir: str,
+    workers: Optional[int] = None
 ) -> pd.DataFrame:
-    bc_cfg = pd.DataFrame()
-    for i in barriers:
-        logger.info(f"bc_cfg {i} doing")
-        for network in rewired_networks:
-            t = pd.read_csv(f"{barrier_crossing_dir}/{network}/{i}.csv.gz")
-            t["network"] = network
-            t = t.groupby("network")["count"].mean().reset_index()
-            t["barrier"] = i
-            bc_cfg = pd.concat([bc_cfg, t])
-    return bc_cfg
+    # the gzipped files are independent, so they are decompressed and parsed
+    # by a process pool, and the frames are concatenated once
+    tasks = [(i, network) for i in barriers for network in rewired_networks]
+    logger.info(f"bc_cfg {len(tasks)} files doing")
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        frames = list(ex.map(partial(read_barrier_crossing,
+                                     barrier_crossing_dir),
+                             *zip(*tasks), chunksize=8))
+    return categorize(pd.concat(frames, ignore_index=True), barriers,
+                      rewired_networks)
 
 
 if __name__ == "__main__":
@@ -195,10 +390,9 @@ if __name__ == "__main__":
 
     bc_obs = {}
     for i in barriers:
-        bc_obs[i] = pd.DataFrame()
-        t = pd.read_csv(f"{opts.barrier_crossing}/observed/{i}.csv.gz")
-        t["network"] = "observed"
-        bc_obs[i] = pd.concat([bc_obs[i], t])
+        bc_obs[i] = read_cached_csv(
+            f"{opts.barrier_crossing}/observed/{i}.csv.gz")
+        bc_obs[i]["network"] = "observed"
     logger.info("bc_obs OK")
 
     rewired_networks = [f"seed{s}_{i}" for s in range(10) for i in range(10)]
@@ -208,8 +402,9 @@ if __name__ == "__main__":
         opts.barrier_crossing, opts.output)
     logger.info("bc_cfg OK")
 
-    cc_obs = pd.read_csv(f"{opts.community_crossing}/observed/inter.csv")
-    cc_obs["barrier"] = cc_obs["barrier"].apply(lambda x: x.split("_")[0])
+    cc_obs = read_cached_csv(f"{opts.community_crossing}/observed/inter.csv")
+    cc_obs["barrier"] = barrier_type(cc_obs["barrier"])
+    cc_obs = categorize(cc_obs, barriers)
     logger.info("cc_obs OK")
 
     cc_cfg = get_cc_cfg(
@@ -218,19 +413,14 @@ if __name__ == "__main__":
         opts.output)
     logger.info("cc_cfg OK")
 
-    q_road1 = merge_eq_parts(bc_obs, bc_cgf, cc_obs, cc_cfg, "road1")
-    q_road2 = merge_eq_parts(bc_obs, bc_cgf, cc_obs, cc_cfg, "road2")
-    q_railways = merge_eq_parts(bc_obs, bc_cgf, cc_obs, cc_cfg, "railways")
-    q_river = merge_eq_parts(bc_obs, bc_cgf, cc_obs, cc_cfg, "river")
-    q_districts = merge_eq_parts(bc_obs, bc_cgf, cc_obs, cc_cfg, "districts")
-    q_neighborhoods = merge_eq_parts(bc_obs, bc_cgf, cc_obs, cc_cfg,
-                                     "neighborhoods")
-
-    q_road1.to_csv(f"{opts.output}/q_road1.csv", index=False)
-    q_road2.to_csv(f"{opts.output}/q_road2.csv", index=False)
-    q_railways.to_csv(f"{opts.output}/q_railways.csv", index=False)
-    q_river.to_csv(f"{opts.output}/q_river.csv", index=False)
-    q_districts.to_csv(f"{opts.output}/q_districts.csv", index=False)
-    q_neighborhoods.to_csv(f"{opts.output}/q_neighborhoods.csv", index=False)
-
-    plot(q_road1, q_road2, q_railways, q_river, q_districts, q_neighborhoods)
+    # the cached frames are read back with strings, so all the frames are
+    # cast to the same categories
+    bc_cgf = categorize(bc_cgf, barriers, rewired_networks)
+    cc_cfg = categorize(cc_cfg, barriers, rewired_networks)
+
+    q = merge_eq_parts(bc_obs, bc_cgf, cc_obs, cc_cfg)
+
+    for i in barriers:
+        q[i].to_csv(f"{opts.output}/q_{i}.csv", index=False)
+
+    plot(*(q[i] for i in barriers))
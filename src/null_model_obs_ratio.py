@@ -10,28 +10,12 @@ import logging
 import sys
 import json
 import pandas as pd
-from typing import Optional
+from null_model import barrier_type, categorize, read_cached_csv
 
 logger = logging.Logger("null model")
 logging.basicConfig(stream=sys.stdout, level=logging.INFO)
 
 
-def read_cross_community_data(
-    networks: list[str],
-    path: str,
-    groupby: list[str] = ["res", "barrier"]
-) -> pd.DataFrame:
-    cc_cfg_raw = pd.DataFrame()
-    for network in networks:
-        t = pd.read_csv(f"{path}/{network}/inter.csv")
-        t["network"] = network
-        cc_cfg_raw = pd.concat([cc_cfg_raw, t])
-
-    cc_cfg = cc_cfg_raw.groupby(groupby)["count"].mean().reset_index()
-    cc_cfg["barrier"] = cc_cfg["barrier"].apply(lambda x: x.split("_")[0])
-    return cc_cfg
-
-
 def merge_eq_parts(
     bc_obs: dict,
     cc_obs: pd.DataFrame,
@@ -41,34 +25,10 @@ def merge_eq_parts(
         .reset_index()
     q.columns = ["res", "cc_obs"]
 
-    q["bc_obs"] = bc_obs[barrier]["count"].sum()
-    q = calculate_crossing_ratio(q)
-
-    return q
-
-
-def calculate_crossing_ratio(x: pd.DataFrame) -> pd.DataFrame:
-    y = x.copy()
-    y["ratio"] = y["bc_obs"] / y["cc_obs"]
-
-    return y
-
-
-def read_cross_barrier_data(
-    rewired_networks: list[str],
-    barriers: list[str],
-    barrier_crossing_dir: str
-) -> pd.DataFrame:
-    bc_cfg = pd.DataFrame()
-    for i in barriers:
-        logger.info(f"bc_cfg {i} doing")
-        for network in rewired_networks:
-            t = pd.read_csv(f"{barrier_crossing_dir}/{network}/{i}.csv.gz")
-            t["network"] = network
-            t = t.groupby("network")["count"].mean().reset_index()
-            t["barrier"] = i
-            bc_cfg = pd.concat([bc_cfg, t])
-    return bc_cfg
+    bc_obs_sum = bc_obs[barrier]["count"].sum()
+    # the ratio is assigned directly, without copying the DataFrame
+    return q.assign(bc_obs=bc_obs_sum,
+                    ratio=bc_obs_sum / q["cc_obs"].to_numpy())
 
 
 if __name__ == "__main__":
@@ -90,14 +50,13 @@ if __name__ == "__main__":
 
     bc_obs = {}
     for i in barriers:
-        bc_obs[i] = pd.DataFrame()
-        t = pd.read_csv(f"{opts.barrier_crossing}/{i}.csv.gz")
-        t["network"] = "observed"
-        bc_obs[i] = pd.concat([bc_obs[i], t])
+        bc_obs[i] = read_cached_csv(f"{opts.barrier_crossing}/{i}.csv.gz")
+        bc_obs[i]["network"] = "observed"
     logger.info("bc_obs OK")
 
-    cc_obs = pd.read_csv(f"{opts.community_crossing}/inter.csv")
-    cc_obs["barrier"] = cc_obs["barrier"].apply(lambda x: x.split("_")[0])
+    cc_obs = read_cached_csv(f"{opts.community_crossing}/inter.csv")
+    cc_obs["barrier"] = barrier_type(cc_obs["barrier"])
+    cc_obs = categorize(cc_obs, barriers)
     logger.info("cc_obs OK")
 
     q_road1 = merge_eq_parts(bc_obs, cc_obs, "road1")
@@ -3,7 +3,9 @@ import geopandas as gpd
 import numpy as np
 import networkx as nx
 import pathlib
-from itertools import repeat
+import random
+from functools import lru_cache
+from itertools import chain
 from multiprocessing import Pool
 from networkx.algorithms.community import louvain_communities
 
@@ -24,42 +26,91 @@ def create_community_df(
     .. note::
         Community ID-s are order numbers, valid only for a given execution.
     """
-    res = {}
-    for i, comms in enumerate(communities):
-        for c in comms:
-            res[c] = i
-    comm_df = pd.DataFrame.from_dict(res, orient="index",
-                                     columns=["community"+column_suffix])
-    comm_df.index.name = "id"
-    comm_df.reset_index(inplace=True)
-    comm_df["id"] = pd.to_numeric(comm_df["id"])
+    # the nodes are flattened in one pass and the community IDs are repeated
+    # by the community sizes, instead of a dict entry per node
+    sizes = np.fromiter(map(len, communities), dtype=np.int64,
+                        count=len(communities))
+    ids = np.array(list(chain.from_iterable(communities)))
+    comm_df = pd.DataFrame({
+        "id": pd.to_numeric(ids),
+        "community" + column_suffix: np.repeat(np.arange(len(sizes)), sizes)
+    })
 
     return comm_df
 
 
+def annotate_blocks(blocks: pd.DataFrame, block_index: pd.Index,
+                    cdf: pd.DataFrame) -> pd.DataFrame:
+    """
+    Annotate the blocks with their communities.
+
+    The result is the same as ``blocks.merge(cdf, on="id", how="left")``,\
+    but the hash table of the block IDs is built only once, and the\
+    geometries are not copied.
+
+    :param blocks: the blocks with unique *id*
+    :param block_index: ``pd.Index(blocks["id"])``
+    :param cdf: community DataFrame, output of :py:func:`create_community_df`
+
+    :return: the blocks with the community columns, missing for the blocks\
+        without community
+
+    ###### Example
+    >>> blocks = pd.DataFrame({"id": [3, 1, 2]})
+    >>> cdf = pd.DataFrame({"id": [1, 3, 9], "community": [0, 1, 1]})
+    >>> annotate_blocks(blocks, pd.Index(blocks["id"]), cdf)
+       id  community
+    0   3        1.0
+    1   1        0.0
+    2   2        NaN
+    """
+    positions = block_index.get_indexer(cdf["id"])
+    found = positions >= 0
+    annotated = blocks.copy(deep=False)
+    for c in cdf.columns.drop("id"):
+        values = cdf[c].to_numpy()
+        if found.sum() < len(blocks):
+            # the blocks without community are missing, as by a left merge
+            column = np.full(len(blocks), np.nan)
+        else:
+            column = np.empty(len(blocks), dtype=values.dtype)
+        column[positions[found]] = values[found]
+        annotated[c] = column
+    return annotated
+
+
 def save_blocks_with_community_annotaion(
     cdf: pd.DataFrame, res: float, run: int
 ) -> None:
     """
-    Save the blocks with community anotations as GeoJSON.
+    Save the blocks with community anotations as GeoParquet or GeoJSON.
 
     :param cdf: community DataFrame.
     :param res: resolution parameter of the Louvain community detection.
     :param run: number of execution with the given resolution.
+
+    .. note::
+        The format is selected by the *format* option, GeoParquet is binary\
+        and columnar, so it is written and read much faster than GeoJSON.
     """
     global hb
+    global block_index
     global options
-    hbc = hb.merge(cdf, on="id", how="left")
+    hbc = annotate_blocks(hb, block_index, cdf)
     path = (f"{options['output']}/{options['target']}/"
             f"{options['community_dir']}/louvain/{run}")
     pathlib.Path(f"{path}/").mkdir(parents=True, exist_ok=True)
-    hbc.to_file(f"{path}/{options['start_date']}_{options['end_date']}"
-                f"_resolution{res}.geojson", driver="GeoJSON")
+    filename = (f"{path}/{options['start_date']}_{options['end_date']}"
+                f"_resolution{res}")
+    if options["format"] == "parquet":
+        hbc.to_parquet(f"{filename}.parquet")
+    else:
+        hbc.to_file(f"{filename}.geojson", driver="GeoJSON")
 
 
 def save_community_df(cdf: pd.DataFrame, res: float, run: int) -> None:
     """
-    Save the community DataFrame.
+    Save the community DataFrame as Feather or CSV.
 
     :param cdf: community DataFrame.
     :param res: resolution parameter of the Louvain community detection.
@@ -68,13 +119,127 @@ def save_community_df(cdf: pd.DataFrame, res: float, run: int) -> None:
     global options
     path = (f"{options['output']}/{options['target']}/"
             f"{options['community_dir']}/louvain/{run}")
-    cdf.to_csv(f"{path}/{options['start_date']}_{options['end_date']}"
-               f"_resolution{res}.csv", index=False)
+    filename = (f"{path}/{options['start_date']}_{options['end_date']}"
+                f"_resolution{res}")
+    if options["format"] == "parquet":
+        cdf.to_feather(f"{filename}.feather")
+    else:
+        cdf.to_csv(f"{filename}.csv", index=False)
+
+
+@lru_cache(maxsize=1)
+def to_igraph(g: nx.Graph):
+    """
+    Convert the network to igraph.
+
+    The network of a worker does not change between the runs, so it is\
+    converted only once.
+
+    :param g: movement network
+
+    :return: the nodes of *g* and the igraph Graph with the same edges and\
+        *weight* attribute, its vertex indices are positions in the nodes
+    """
+    import igraph as ig
+
+    nodes = list(g.nodes())
+    index = {node: i for i, node in enumerate(nodes)}
+    edges = [(index[u], index[v]) for u, v in g.edges()]
+    weights = [w for _, _, w in g.edges(data="weight", default=1)]
+    return nodes, ig.Graph(n=len(nodes), edges=edges,
+                           edge_attrs={"weight": weights})
+
+
+@lru_cache(maxsize=1)
+def to_networkit(g: nx.Graph):
+    """
+    Convert the network to NetworKit.
+
+    The network of a worker does not change between the runs, so it is\
+    converted only once.
+
+    :param g: movement network
+
+    :return: the nodes of *g* and the NetworKit Graph with the same weighted\
+        edges, its node IDs are positions in the nodes
+    """
+    import networkit as nk
+
+    # nx2nk relabels the nodes to 0..n-1 in the order of g.nodes()
+    return list(g.nodes()), nk.nxadapter.nx2nk(g, weightAttr="weight")
+
+
+def detect_communities(g: nx.Graph, res: float, seed: int,
+                       backend: str = "networkx") -> list:
+    """
+    Run the Louvain community detection.
+
+    :param g: movement network
+    :param res: resolution parameter of the Louvain community detection.
+    :param seed: random seed
+    :param backend: *networkx* (pure Python), *networkit* (parallel Louvain,\
+        PLM), *igraph* (multilevel Louvain in C) or *cugraph* (GPU,\
+        dispatched by NetworkX to ``nx-cugraph``)
+
+    :return: list of node sets, the same format as\
+        ``networkx.algorithms.community.louvain_communities`` returns
+    """
+    if backend == "networkit":
+        import networkit as nk
+
+        nk.engineering.setSeed(seed, False)
+        nodes, nk_g = to_networkit(g)
+        plm = nk.community.PLM(nk_g, gamma=res)
+        plm.run()
+        return [{nodes[u] for u in c}
+                for c in plm.getPartition().getSubsets()]
+    if backend == "igraph":
+        import igraph as ig
+
+        # igraph draws from the random module by default, a generator of its
+        # own keeps the global state of the module untouched
+        ig.set_random_number_generator(random.Random(seed))
+        nodes, ig_g = to_igraph(g)
+        clustering = ig_g.community_multilevel(weights="weight",
+                                               resolution=res)
+        return [{nodes[u] for u in c} for c in clustering]
+    if backend == "cugraph":
+        return louvain_communities(g, resolution=res, seed=seed,
+                                   backend="cugraph")
+    return louvain_communities(g, resolution=res, seed=seed)
+
+
+def init_worker(network: nx.Graph, blocks: gpd.GeoDataFrame,
+                opts: dict) -> None:
+    """
+    Initialize a worker of the community detection pool.
+
+    The network and the blocks are sent to each worker only once, instead\
+    of relying on the globals inherited by fork. The index of the block IDs\
+    is built here once, and the network is converted to the graph format of\
+    the backend as well, so the runs share them.
+
+    :param network: movement network
+    :param blocks: blocks to annotate with the communities
+    :param opts: output options of the annotated blocks and communities
+    """
+    global g
+    global hb
+    global block_index
+    global options
+    g = network
+    hb = blocks
+    block_index = pd.Index(hb["id"])
+    options = opts
+    converters = {"networkit": to_networkit, "igraph": to_igraph}
+    if options["backend"] in converters:
+        converters[options["backend"]](g)
 
 
 def kernel(run: int, res: float) -> pd.DataFrame:
     global g
-    communities = louvain_communities(g, resolution=res, seed=run)
+    global options
+    communities = detect_communities(g, res, run, options["backend"])
     cdf = create_community_df(communities)
 
     save_blocks_with_community_annotaion(cdf, res, run)
@@ -143,6 +308,15 @@ if __name__ == "__main__":
                         default="", help="output version")
     parser.add_argument("--output", type=str, required=False,
                         default="output", help="output directory")
+    parser.add_argument("--backend", type=str, required=False,
+                        default="networkx",
+                        choices=["networkx", "networkit", "igraph",
+                                 "cugraph"],
+                        help="Louvain implementation")
+    parser.add_argument("--format", type=str, required=False,
+                        default="parquet", choices=["parquet", "geojson"],
+                        help="format of the annotated blocks (GeoParquet or "
+                             "GeoJSON) and the communities (Feather or CSV)")
     opts = parser.parse_args()
 
     hb = gpd.read_file(opts.blocks)
@@ -158,16 +332,17 @@ if __name__ == "__main__":
 
     options = {"output": opts.output, "target": opts.target,
                "community_dir": opts.community_dir,
-               "start_date": opts.start_date, "end_date": opts.end_date}
-    result = pd.DataFrame()
-    for res in np.arange(opts.resolution_start, opts.resolution_stop,
-                         opts.resolution_step):
-        logger.info(f"resolution {res}")
-        with Pool(opts.pool) as pool:
-            partials = pool.starmap(
-                kernel,
-                zip(range(opts.run_start, opts.run_stop), repeat(res))
-            )
-            for i in partials:
-                result = pd.concat([result, i])
+               "start_date": opts.start_date, "end_date": opts.end_date,
+               "backend": opts.backend, "format": opts.format}
+    # the runs of all resolutions are dispatched to a single pool, so the
+    # workers are started and initialized only once
+    tasks = [(run, res)
+             for res in np.arange(opts.resolution_start, opts.resolution_stop,
+                                  opts.resolution_step)
+             for run in range(opts.run_start, opts.run_stop)]
+    logger.info(f"{len(tasks)} runs")
+    with Pool(opts.pool, initializer=init_worker,
+              initargs=(g, hb, options)) as pool:
+        partials = pool.starmap(kernel, tasks, chunksize=1)
+    result = pd.concat(partials)
     result.to_pickle(output_file)
@@ -1,15 +1,18 @@
+import io
 import pandas as pd
 
 
 def read_gravityjl_output(filename: str) -> pd.DataFrame:
+    # the header and the footer are dropped here, so the C parser can be used
+    # instead of the pure Python one required by skipfooter
+    with open(filename) as fp:
+        lines = fp.readlines()[8:-1]
     m = pd.read_csv(
-        filename,
-        skiprows=[0, 1, 2, 3, 4, 5, 6, 7],
-        skipfooter=1,
-        sep="\s+",
+        io.StringIO("".join(lines)),
+        sep=r"\s+",
         names=["log(mob_ij)", "|", "Estimate", "Std.Error", "t value",
                "Pr(>|t|)", "Lower 95%", "Upper 95%"],
-        engine="python"
+        engine="c"
         )
     m.drop("|", axis=1, inplace=True)
     m.rename({"log(mob_ij)": "coefficient"}, axis=1, inplace=True)
@@ -24,19 +27,20 @@ def prepare_data(
     distr: pd.DataFrame,
     adm10: pd.DataFrame
 ) -> pd.DataFrame:
-    df = pd.DataFrame()
-    df = pd.concat([df, road1.query("coefficient == 'primary_count'")])
-    df = pd.concat([df, road2.query("coefficient == 'secondary_count'")])
-    df = pd.concat([df, railw.query("coefficient == 'railway_count'")])
-    df = pd.concat([df, river.query("coefficient == 'river_count'")])
-    df = pd.concat([df, distr.query("coefficient == 'districts_count'")])
-    df = pd.concat([df, adm10.query("coefficient == 'neighborhoods_count'")])
-
-    df.reset_index(drop=True, inplace=True)
+    # each model has its own barrier coefficient, so the models are filtered
+    # by boolean masks and concatenated once
+    models = {
+        "primary_count": road1, "secondary_count": road2,
+        "railway_count": railw, "river_count": river,
+        "districts_count": distr, "neighborhoods_count": adm10,
+    }
+    df = pd.concat([m[m["coefficient"] == c] for c, m in models.items()],
+                   ignore_index=True)
+
     df = df[["coefficient", "Estimate", "Lower 95%", "Upper 95%"]].copy()
     df.columns = ["label", "coefficient", "lower", "upper"]
     df["error"] = df["coefficient"]-df["lower"]
-    df["label"] = df["label"].apply(lambda x: x.split("_count")[0])
+    df["label"] = df["label"].str.split("_count").str[0]
     df.set_index("label", inplace=True)
     df = df.reindex(list(label_lookup.keys()))
     df.reset_index(inplace=True)
@@ -47,7 +51,7 @@ def prepare_data(
 
 def prepare_total(total: pd.DataFrame) -> pd.DataFrame:
     df = total.copy()
-    df["coefficient"] = df["coefficient"].apply(lambda x: x.split("_count")[0])
+    df["coefficient"] = df["coefficient"].str.split("_count").str[0]
     df = df[["coefficient", "Estimate", "Lower 95%", "Upper 95%"]].copy()
     df.columns = ["label", "coefficient", "lower", "upper"]
     df["error"] = df["coefficient"] - df["lower"]
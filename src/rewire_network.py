@@ -9,26 +9,31 @@ follow the schema of ``seed{seed}_{i}.edgelist.gz``.
   A. *The configuration multi-edge model: Assessing the effect of fixing node\
   strengths on weighted network magnitudes*. Europhys. Lett. 107, 38002 (2014).
 """
-import pandas as pd
 import networkx as nx
 import numpy as np
+import gzip
+import heapq
 import logging
-import random
 import matplotlib.pyplot as plt
 from typing import Any, Optional, Iterable
 from collections import Counter
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
 
 logger = logging.getLogger("network rewiring")
 logger.setLevel(logging.DEBUG)
 
 
 def rewire_network(
-    g: dict[Any, int], seed: Optional[int] = None, threshold: int = 10_000
+    g: dict[Any, int], seed: Optional[int] = None, threshold: int = 10_000,
+    rng: Optional[np.random.Generator] = None
 ) -> list[tuple[Any, Any]] | float:
     """
     Rewire network.
 
     :param g: Nodes with degree.
+    :param seed: seed of the random generator, if *rng* is not given
+    :param rng: random generator
 
     :return: list of tuples or NaN
 
@@ -45,48 +50,170 @@ def rewire_network(
     [('a', 'b'), ('a', 'b'), ('a', 'c')]
     >>> rewire_network({'a': 3, 'b': 2, 'c': 1, 'd': 18, 'e': 4, 'f': 2,\
                         'g': 1, 'h': 4, 'i': 3, 'j': 1, 'k': 2, 'l': 1},\
-                       seed=0)
+                       seed=1)
     ... # doctest: +NORMALIZE_WHITESPACE
-    [('d', 'a'), ('d', 'l'), ('d', 'h'), ('d', 'c'), ('d', 'j'), ('d', 'g'),\
-     ('d', 'f'), ('d', 'a'), ('d', 'k'), ('d', 'i'), ('d', 'e'), ('d', 'k'),\
-     ('d', 'b'), ('d', 'e'), ('d', 'e'), ('d', 'a'), ('d', 'b'), ('d', 'f'),\
-     ('h', 'e'), ('h', 'i'), ('h', 'i')]
+    [('d', 'a'), ('d', 'a'), ('d', 'a'), ('d', 'b'), ('d', 'c'), ('d', 'e'),\
+     ('d', 'e'), ('d', 'f'), ('d', 'f'), ('d', 'g'), ('d', 'h'), ('d', 'h'),\
+     ('d', 'i'), ('d', 'i'), ('d', 'j'), ('d', 'k'), ('d', 'k'), ('d', 'l'),\
+     ('e', 'h'), ('e', 'i'), ('b', 'h')]
     """
-    res = []
-    req = {k: v for k, v in g.items() if v > 0}
+    if rng is None:
+        rng = np.random.default_rng(seed)
+    # the nodes are integer IDs and the remaining degrees an array, the
+    # labels are mapped back only on return
+    labels = [k for k, v in g.items() if v > 0]
+    remaining = np.fromiter((g[k] for k in labels), dtype=np.int32,
+                            count=len(labels))
+    # the node with the largest remaining degree is popped from a max-heap,
+    # the ID breaks the ties
+    heap = [(-int(v), i) for i, v in enumerate(remaining)]
+    heapq.heapify(heap)
+    sources, targets, multiplicities = [], [], []
+    # the number of remaining stubs, an odd one cannot be paired at all
+    total = int(remaining.sum())
+    if total % 2:
+        return np.nan
+
+    while (q0 := pop_max(heap, remaining)) is not None:
+        q1 = int(remaining[q0])
+        remaining[q0] = 0
+        total -= q1
+        # q0 has the largest remaining degree, if the other nodes cannot
+        # absorb its stubs, the network is infeasible already
+        if q1 > total:
+            return np.nan
+
+        # the nodes without remaining degree, q0 included, have no capacity,
+        # so the array is passed as it is instead of gathering the active ones
+        try:
+            lrc = limited_random_counts(remaining, q1, rng=rng)
+        except ValueError:
+            return np.nan
+        if lrc is None:
+            continue
+        counts, _ = lrc
+        nodes = np.flatnonzero(counts)
+        remaining[nodes] -= counts[nodes]
+        total -= q1
+        sources.append(np.full(len(nodes), q0))
+        targets.append(nodes)
+        multiplicities.append(counts[nodes])
+        for i in nodes[remaining[nodes] > 0].tolist():
+            heapq.heappush(heap, (-int(remaining[i]), i))
+
+    if not sources:
+        return []
+    multiplicities = np.concatenate(multiplicities)
+    u = np.repeat(np.concatenate(sources), multiplicities)
+    v = np.repeat(np.concatenate(targets), multiplicities)
+    return [(labels[a], labels[b]) for a, b in zip(u.tolist(), v.tolist())]
+
+
+def pop_max(heap: list[tuple[int, int]], remaining: np.ndarray) -> int | None:
+    """
+    Pop the node with the largest remaining degree from the heap.
 
-    while len({k: v for k, v in req.items() if v > 0}) > 0:
-        req = dict(sorted(req.items(), key=lambda x: x[1]))
-        req = {k: v for k, v in req.items() if v > 0}
+    The heap is updated lazily, the entries whose degree differs from the\
+    remaining degree of the node are outdated and skipped.
 
-        q0 = list(req)[-1]
-        q1 = req.pop(q0)
+    :param heap: max-heap of (negative degree, node ID) entries
+    :param remaining: remaining degrees by node ID
 
-        req = dict(req)
+    :return: the node ID, or None if the heap is exhausted
 
-        try:
-            lrc = limited_random_choice(list(req.keys()), n=q1, limits=req,
-                                        seed=seed)
-            if lrc is None:
-                continue
-            iter, _, _ = lrc
-            for i in iter:
-                res.append((q0, i))
-                req[i] -= 1
-        except ValueError:
-            return np.NaN
-    return res
+    ###### Example
+    >>> heap = [(-3, 0), (-1, 1), (-2, 2)]
+    >>> heapq.heapify(heap)
+    >>> pop_max(heap, np.array([1, 1, 2]))
+    2
+    """
+    while heap:
+        degree, node = heapq.heappop(heap)
+        if remaining[node] == -degree:
+            return node
+    return None
+
+
+def rewire_network_stubs(
+    g: dict[Any, int], rng: Optional[np.random.Generator] = None,
+    threshold: int = 10_000, jit: bool = False
+) -> list[tuple[Any, Any]] | float:
+    """
+    Rewire network by pairing the stubs (half-edges) uniformly at random.
+
+    Each node is repeated by its degree, the stubs are shuffled once and the\
+    consecutive pairs are the edges, so the network is generated in linear\
+    time without rejection. Self-loops are not allowed, as by\
+    :py:func:`rewire_network`, so a self-loop is replaced by swapping its\
+    end with a random edge not incident to the node, which keeps the degrees.
+
+    :param g: Nodes with degree.
+    :param rng: random generator (default a new unseeded one)
+    :param threshold: number of tries to find an edge to swap a self-loop\
+        with
+    :param jit: if True, the stubs are paired by the Numba kernel\
+        :py:func:`rewire_network_numba.pair_stubs`, seeded from *rng*
+
+    :return: list of tuples or NaN if the sum of the degrees is odd, or a\
+        self-loop cannot be removed
+
+    ###### Examples
+    >>> rewire_network_stubs({'a': 3, 'b': 1, 'c': 1})
+    nan
+    >>> rewire_network_stubs({'a': 3, 'b': 2, 'c': 1},
+    ...                      np.random.default_rng(5))
+    [('a', 'b'), ('a', 'b'), ('c', 'a')]
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    nodes = np.array(list(g.keys()), dtype=object)
+    degrees = np.fromiter(g.values(), dtype=np.int64, count=len(g))
+    if degrees.sum() % 2:
+        return np.nan
+    if jit:
+        from rewire_network_numba import pair_stubs
+
+        u, v, ok = pair_stubs(degrees, int(rng.integers(2**32)), threshold)
+        if not ok:
+            return np.nan
+        return list(zip(nodes[u].tolist(), nodes[v].tolist()))
+
+    stubs = np.repeat(np.arange(len(nodes)), degrees)
+    rng.shuffle(stubs)
+    u, v = stubs[0::2].copy(), stubs[1::2].copy()
+
+    for e in np.flatnonzero(u == v):
+        # an earlier swap may have removed this self-loop already
+        if u[e] != v[e]:
+            continue
+        node = u[e]
+        for _ in range(threshold):
+            f = rng.integers(len(u))
+            if u[f] != node and v[f] != node:
+                break
+        else:
+            return np.nan
+        # (node, node) and (x, y) become (node, x) and (node, y)
+        v[e], u[f] = u[f], node
+    return list(zip(nodes[u].tolist(), nodes[v].tolist()))
 
 
 def generate_networks_from_graph(
     g: nx.Graph, n: int, seed: Optional[int] = None,
-    infinite_loop_threshold: int = 10_000
+    infinite_loop_threshold: int = 10_000, legacy: bool = False,
+    jit: bool = False, workers: Optional[int] = None
 ) -> list[tuple[tuple[Any, Any], ...]] | None:
     """
     Generate n new networks keeping the degrees of the input network.
 
     :param g: source network
     :param n: number of desired networks
+    :param legacy: if True, :py:func:`rewire_network` is used instead of\
+        :py:func:`rewire_network_stubs`
+    :param jit: if True, the stubs are paired by the Numba kernel (requires\
+        Numba)
+    :param workers: number of worker processes (default the number of\
+        CPUs), 1 generates the networks in the calling process
 
     :return: list with n networks
 
@@ -97,25 +224,33 @@ def generate_networks_from_graph(
     ###### Example
     >>> g = nx.MultiGraph()
     >>> _ = g.add_edges_from([('a', 'b'), ('a', 'b'), ('a', 'c')])
-    >>> generate_networks_from_graph(g, 3, seed=11)
+    >>> generate_networks_from_graph(g, 3, seed=11, legacy=True)
     ... # doctest: +NORMALIZE_WHITESPACE
     [(('a', 'b'), ('a', 'b'), ('a', 'c')),
-     (('a', 'c'), ('a', 'b'), ('a', 'b')),
-     (('a', 'b'), ('a', 'c'), ('a', 'b'))]
+     (('a', 'b'), ('a', 'b'), ('a', 'c')),
+     (('a', 'b'), ('a', 'b'), ('a', 'c'))]
     """
     degrees = dict(g.degree())
-    return generate_networks(degrees, n, seed, infinite_loop_threshold)
+    return generate_networks(degrees, n, seed, infinite_loop_threshold,
+                             legacy, jit, workers)
 
 
 def generate_networks(
     g: dict[Any, int], n: int, seed: Optional[int] = None,
-    infinite_loop_threshold: int = 10_000
+    infinite_loop_threshold: int = 10_000, legacy: bool = False,
+    jit: bool = False, workers: Optional[int] = None
 ) -> list[tuple[tuple[Any, Any], ...]] | None:
     """
     Generate n new networks keeping the degrees of the input network.
 
     :param g: source network as degree dictionary
     :param n: number of desired networks
+    :param legacy: if True, :py:func:`rewire_network` is used instead of\
+        :py:func:`rewire_network_stubs`
+    :param jit: if True, the stubs are paired by the Numba kernel (requires\
+        Numba)
+    :param workers: number of worker processes (default the number of\
+        CPUs), 1 generates the networks in the calling process
 
     :return: list with n networks
 
@@ -126,49 +261,106 @@ def generate_networks(
     ###### Examples
     >>> g = {'a': 3, 'b': 1, 'c': 1}
     >>> generate_networks(g, 2, seed=1450, infinite_loop_threshold=10)
-    >>> generate_networks({'a': 3, 'b': 2, 'c': 1}, 3, seed=11)
+    >>> generate_networks({'a': 3, 'b': 2, 'c': 1}, 3, seed=11, legacy=True)
     ... # doctest: +NORMALIZE_WHITESPACE
     [(('a', 'b'), ('a', 'b'), ('a', 'c')),
-     (('a', 'c'), ('a', 'b'), ('a', 'b')),
-     (('a', 'b'), ('a', 'c'), ('a', 'b'))]
+     (('a', 'b'), ('a', 'b'), ('a', 'c')),
+     (('a', 'b'), ('a', 'b'), ('a', 'c'))]
     """
     results = []  # type: list[tuple[tuple[Any, Any], ...]]
     k = 0
-    if seed:
-        random.seed(seed)
-    while len(results) < n:
-        res = rewire_network(g)
-        if not isinstance(res, float):
-            results.append(tuple(res))
-        else:
-            logger.debug("rewired graph is invalid")
-        k += 1
-        if k == infinite_loop_threshold:
-            return None
+    # every network gets its own child seed, so the result does not depend
+    # on the number of workers
+    seeds = np.random.SeedSequence(seed)
+    rewire = partial(rewire_with_seed, g=g, legacy=legacy, jit=jit)
+    ex = ProcessPoolExecutor(max_workers=workers) if workers != 1 else None
+    try:
+        while len(results) < n:
+            # the invalid networks are topped up by the next batch
+            batch = min(n - len(results), infinite_loop_threshold - k)
+            if batch <= 0:
+                return None
+            children = seeds.spawn(batch)
+            for res in (ex.map(rewire, children) if ex else
+                        map(rewire, children)):
+                if not isinstance(res, float):
+                    results.append(tuple(res))
+                else:
+                    logger.debug("rewired graph is invalid")
+            k += batch
+    finally:
+        if ex:
+            ex.shutdown()
 
     return results
 
 
+def rewire_with_seed(
+    seed: np.random.SeedSequence, g: dict[Any, int], legacy: bool = False,
+    jit: bool = False
+) -> list[tuple[Any, Any]] | float:
+    """
+    Rewire network with a random generator of its own, in a worker process.
+
+    :param seed: seed of the random generator
+    :param g: Nodes with degree.
+    :param legacy: if True, :py:func:`rewire_network` is used instead of\
+        :py:func:`rewire_network_stubs`
+    :param jit: if True, the stubs are paired by the Numba kernel
+
+    :return: list of tuples or NaN
+    """
+    rng = np.random.default_rng(seed)
+    if legacy:
+        return rewire_network(g, rng=rng)
+    return rewire_network_stubs(g, rng, jit=jit)
+
+
+def write_network(network: Iterable[tuple[Any, Any]], path: str,
+                  compresslevel: int = 1) -> str:
+    """
+    Write rewired network as weighted edgelist, in a worker process.
+
+    :param network: list of edges (u, v)
+    :param path: output filename, compressed if it ends with *.gz*
+    :param compresslevel: gzip compression level, the fastest by default\
+        instead of the level 9 NetworkX applies
+
+    :return: the path
+    """
+    G = convert_to_graph(network)
+    if path.endswith(".gz"):
+        with gzip.open(path, "wb", compresslevel=compresslevel) as fp:
+            nx.write_edgelist(G, fp)
+    else:
+        nx.write_edgelist(G, path)
+    return path
+
+
 def convert_to_graph(edgelist: Iterable[tuple[Any, Any]]) -> nx.Graph:
     """
     Convert edge list to graph.
 
+    The multiplicities are counted by a ``Counter`` in one pass, the edges\
+    are added in the order of their first occurrence. The graph is\
+    undirected, so the counts of (u, v) and (v, u) are summed.
+
     :param edgelist: list of edges (u, v)
 
     :return: a networkx graph
 
     ###### Examples
-    >>> el = [('a', 'b'), ('a', 'b'), ('a', 'c')]
+    >>> el = [('a', 'b'), ('a', 'b'), ('a', 'c'), ('b', 'a')]
     >>> G = convert_to_graph(el)
     >>> G.edges.data()
-    EdgeDataView([('a', 'b', {'weight': 2}), ('a', 'c', {'weight': 1})])
+    EdgeDataView([('a', 'b', {'weight': 3}), ('a', 'c', {'weight': 1})])
     """
-    res_df = pd.DataFrame.from_records(edgelist, columns=["source", "target"])
-    res_df["weight"] = 1
-    res_df_weighted = res_df.groupby(["source", "target"])\
-                            .count().reset_index()
-
-    G = nx.from_pandas_edgelist(res_df_weighted, edge_attr=["weight"])
+    G = nx.Graph()
+    for (u, v), w in Counter(edgelist).items():
+        if G.has_edge(u, v):
+            G[u][v]["weight"] += w
+        else:
+            G.add_edge(u, v, weight=w)
     return G
 
 
@@ -195,17 +387,25 @@ def plot_graph(G: nx.Graph, seed: int = 5) -> tuple[plt.Figure, plt.Axes]:
 
 def limited_random_choice(
     a: list, n: int, limits: dict[Any, int],
-    seed: Optional[int] = None, threshold: int = 1_000_000
+    seed: Optional[int] = None, threshold: int = 1_000_000,
+    rng: Optional[np.random.Generator] = None
 ) -> tuple[list, dict, int] | None:
     """
     Choose *n* elements from a collection with replacement, but respecting the\
         given limits of how many time a given element can be chosen.
 
+    The elements are drawn by :py:func:`limited_random_counts` on their\
+    positions in *a*.
+
     :param a: input list
     :param n: number of elements to choose
+    :param limits: maximum number of times an element can be chosen
+    :param seed: seed of the random generator, if *rng* is not given
+    :param threshold: maximum number of batches
+    :param rng: random generator
 
     ###### Returns
-    - list of the chosen elements
+    - list of the chosen elements, grouped by element in the order of *a*
     - counter of the chosen element list
     - number of misses
 
@@ -213,38 +413,81 @@ def limited_random_choice(
 
     ###### Examples
     >>> limited_random_choice([1, 2, 3], 2, {1: 1, 2: 1, 3: 2}, seed=20)
-    ([3, 3], {3: 2}, 0)
-    >>> limited_random_choice(['a', 'b', 'c'], 2, {'a': 3, 'b': 2, 'c': 1},\
-                              seed=20)
-    (['c', 'a'], {'c': 1, 'a': 1}, 1)
+    ([1, 3], {1: 1, 3: 1}, 0)
+    >>> limited_random_choice(['a', 'b', 'c'], 5, {'a': 3, 'b': 2, 'c': 1},\
+                              seed=1)
+    (['a', 'a', 'b', 'b', 'c'], {'a': 2, 'b': 2, 'c': 1}, 1)
     >>> limited_random_choice([1, 2, 3], 7, {1: 1, 2: 2, 3: 3}, seed=7)
     Traceback (most recent call last):
     ValueError: n cannot be larger than the sum of limits
     """
     if n > sum(limits.values()):
         raise ValueError("n cannot be larger than the sum of limits")
-    counter = {}  # type: dict
-    result = []
-    k = 0
+    capacity = np.fromiter((limits[s] for s in a), dtype=np.int64,
+                           count=len(a))
+    lrc = limited_random_counts(capacity, n, seed, threshold, rng)
+    if lrc is None:
+        return None
+    counts, miss = lrc
+
+    chosen = np.flatnonzero(counts)
+    result = [a[i] for i in np.repeat(chosen, counts[chosen])]
+    counter = {a[i]: int(counts[i]) for i in chosen}
+    return result, counter, miss
+
+
+def limited_random_counts(
+    capacity: np.ndarray, n: int, seed: Optional[int] = None,
+    threshold: int = 1_000_000, rng: Optional[np.random.Generator] = None
+) -> tuple[np.ndarray, int] | None:
+    """
+    Choose *n* positions with replacement, at most *capacity* times each.
+
+    The positions with zero capacity are never chosen.
+
+    The positions are drawn in batches: the missing number of positions is\
+    drawn at once from the ones below their capacity, the draws are counted\
+    by ``np.bincount`` and the counts are clipped to the remaining capacity.\
+    The clipped draws are the misses, and the next batch tops up the result.
+
+    :param capacity: maximum number of times a position can be chosen
+    :param n: number of positions to choose
+    :param seed: seed of the random generator, if *rng* is not given
+    :param threshold: maximum number of batches
+    :param rng: random generator
+
+    ###### Returns
+    - number of times the positions are chosen
+    - number of misses
+
+    :raises ValueError: if *n* is larger than the sum of capacities
+
+    ###### Example
+    >>> limited_random_counts(np.array([3, 2, 1]), 5, seed=1)
+    (array([2, 2, 1]), 1)
+    """
+    if n > capacity.sum():
+        raise ValueError("n cannot be larger than the sum of limits")
+    if rng is None:
+        rng = np.random.default_rng(seed)
+    counts = np.zeros(len(capacity), dtype=np.int64)
+    # the number of chosen positions is kept instead of summing the counts
+    total = 0
     miss = 0
-    if seed:
-        random.seed(seed)
-    while sum(counter.values()) < n:
-        k += 1
-        if k == threshold:
+    k = 0
+    while (need := n - total) > 0:
+        available = np.flatnonzero(counts < capacity)
+        if k == threshold or len(available) == 0:
             return None
-        s = random.choice(a)
-        if s not in counter:
-            counter[s] = 1
-            result.append(s)
-        elif counter[s] < limits[s]:
-            counter[s] += 1
-            result.append(s)
-        else:
-            miss += 1
-            continue
-
-    return result, counter, miss
+        k += 1
+        drawn = np.bincount(rng.choice(available, size=need),
+                            minlength=len(capacity))
+        accepted = np.minimum(drawn, capacity - counts)
+        hits = int(accepted.sum())
+        total += hits
+        miss += need - hits
+        counts += accepted
+    return counts, miss
 
 
 def to_d2(edgelist: list, horizontal: bool = False) -> str:
@@ -326,19 +569,28 @@ if __name__ == "__main__":
     parser.add_argument("-s", "--seed", type=int, required=False, default=None)
     parser.add_argument("--output", type=str, required=False,
                         default="output/network", help="output directory")
+    parser.add_argument("--legacy", action="store_true",
+                        help="rewire by the former rejection sampling")
+    parser.add_argument("--jit", action="store_true",
+                        help="pair the stubs by the Numba kernel")
+    parser.add_argument("--workers", type=int, required=False, default=None,
+                        help="number of worker processes")
     opts = parser.parse_args()
 
     h = nx.read_edgelist(opts.input)
     h_ = convert_weighted_to_multigraph(h)
     networks = generate_networks_from_graph(h_, opts.number_of_networks,
-                                            seed=opts.seed)
+                                            seed=opts.seed,
+                                            legacy=opts.legacy,
+                                            jit=opts.jit,
+                                            workers=opts.workers)
 
     path = pathlib.Path(opts.output)
     if networks:
-        for i, network in enumerate(networks):
-            G = convert_to_graph(network)
-            if not path.exists():
-                path.mkdir(parents=True, exist_ok=True)
-            nx.write_edgelist(
-                G, f"{str(path)}/seed{opts.seed}_{i}.edgelist.gz"
-            )
+        path.mkdir(parents=True, exist_ok=True)
+        filenames = [f"{str(path)}/seed{opts.seed}_{i}.edgelist.gz"
+                     for i in range(len(networks))]
+        # the conversion and the compression are parallelized as well
+        with ProcessPoolExecutor(max_workers=opts.workers) as ex:
+            for filename in ex.map(write_network, networks, filenames):
+                print(filename)
@@ -0,0 +1,66 @@
+"""
+Numba kernel of the stub pairing of :py:mod:`rewire_network`.
+
+Numba is an optional dependency, the module is imported only if the JIT\
+compiled rewiring is requested (``--jit``). The nodes are integer IDs here,\
+the labels are mapped by the caller.
+"""
+import numpy as np
+from numba import njit
+
+
+@njit(cache=True)
+def pair_stubs(
+    degrees: np.ndarray, seed: int, threshold: int = 10_000
+) -> tuple[np.ndarray, np.ndarray, bool]:
+    """
+    Pair the stubs (half-edges) uniformly at random, without self-loops.
+
+    The stubs are shuffled by Fisher-Yates in a preallocated buffer, then\
+    the self-loops are removed by swapping with a random edge not incident\
+    to the node, as by :py:func:`rewire_network.rewire_network_stubs`.
+
+    :param degrees: degree of the nodes, the sum must be even
+    :param seed: seed of the random generator of Numba
+    :param threshold: number of tries to find an edge to swap a self-loop\
+        with
+
+    ###### Returns
+    - source node IDs of the edges
+    - target node IDs of the edges
+    - False if a self-loop cannot be removed
+
+    ###### Example
+    >>> u, v, ok = pair_stubs(np.array([3, 2, 1]), 5)
+    >>> ok, sorted(zip(np.minimum(u, v).tolist(), np.maximum(u, v).tolist()))
+    (True, [(0, 1), (0, 1), (0, 2)])
+    """
+    np.random.seed(seed)
+    stubs = np.empty(degrees.sum(), dtype=np.int64)
+    k = 0
+    for i in range(len(degrees)):
+        for _ in range(degrees[i]):
+            stubs[k] = i
+            k += 1
+    for i in range(len(stubs) - 1, 0, -1):
+        j = np.random.randint(0, i + 1)
+        stubs[i], stubs[j] = stubs[j], stubs[i]
+
+    u, v = stubs[0::2].copy(), stubs[1::2].copy()
+    m = len(u)
+    for e in range(m):
+        if u[e] != v[e]:
+            continue
+        node = u[e]
+        found = False
+        for _ in range(threshold):
+            f = np.random.randint(0, m)
+            if u[f] != node and v[f] != node:
+                found = True
+                break
+        if not found:
+            return u, v, False
+        # (node, node) and (x, y) become (node, x) and (node, y)
+        v[e] = u[f]
+        u[f] = node
+    return u, v, True
@@ -1,32 +1,98 @@
-import os
 import sys
 import logging
+import numpy as np
 import pandas as pd
+import shapely
+from typing import Optional
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pyproj import Transformer
 
 logger = logging.getLogger("movement to empty mesh")
 logging.basicConfig(stream=sys.stdout, level=logging.INFO)
 
 
-def calculate_trip_length_stream(path: str, output: str) -> None:
-    with pd.read_pickle(path, chunksize=1_000_000) as reader:
-        for k, chunk in enumerate(reader):
+def beeline_length(
+    geometry: pd.Series, transformer: Optional[Transformer] = None
+) -> np.ndarray:
+    """
+    Calculate the length of beelines from their endpoint coordinates.
+
+    A beeline is a two-point line, so its length is the distance of the\
+    endpoints, calculated by NumPy on the coordinate array instead of by\
+    GEOS per geometry.
+
+    :param geometry: two-point lines in a metric CRS, or in the source CRS\
+        of *transformer*
+    :param transformer: transformer to the metric CRS applied to the\
+        coordinates (default None, the coordinates are used as they are)
+
+    :return: length of the lines
+
+    ###### Example
+    >>> from shapely.geometry import LineString
+    >>> beeline_length(pd.Series([LineString([(0, 0), (3, 4)]),
+    ...                           LineString([(1, 1), (1, 3)])]))
+    array([5., 2.])
+    """
+    xy = shapely.get_coordinates(np.asarray(geometry))
+    x, y = xy[:, 0], xy[:, 1]
+    if transformer is not None:
+        x, y = transformer.transform(x, y)
+    return np.hypot(x[1::2] - x[0::2], y[1::2] - y[0::2])
+
+
+def calculate_trip_length_stream(path: str, output: str,
+                                 chunksize: int = 1_000_000) -> None:
+    """
+    Calculate the length of the beeline trips in chunks.
+
+    The trips are reprojected to EPSG:23700 on the raw endpoint coordinates\
+    by a single pyproj transformer, and the length of a beeline is the\
+    distance of its endpoints, so no geometries are built per chunk. The\
+    chunks are written as row groups of one Parquet file by a single\
+    writer, with the schema of the first chunk.
+
+    :param path: pickled trips with a *geometry* column of two-point lines,\
+        in EPSG:4326 if it has no CRS
+    :param output: output Parquet filename, overwritten if exists
+    :param chunksize: number of trips processed at once
+
+    .. note::
+        A pickle cannot be read in chunks, so the trips are loaded once and
+        the chunks are the row slices of it.
+    """
+    trips = pd.read_pickle(path)
+    crs = getattr(trips, "crs", None) or 4326
+    transformer = Transformer.from_crs(crs, 23700, always_xy=True)
+    columns = trips.columns.drop("geometry")
+
+    writer = None
+    try:
+        for k, start in enumerate(range(0, len(trips), chunksize)):
             logger.info(f"heartbeat: {k}")
 
-            temp = chunk.copy()
-            temp.to_crs(23700, inplace=True)
-            temp["length"] = temp["geometry"].length
-            temp.drop("geometry", axis=1, inplace=True)
+            chunk = trips.iloc[start:start + chunksize]
+            length = beeline_length(chunk["geometry"], transformer)
 
-            # header inspiration: https://stackoverflow.com/a/17975690/4737417
-            temp.to_csv(output, index=False, mode="a",
-                        header=not os.path.exists(output))
+            table = pa.Table.from_pandas(
+                pd.DataFrame(chunk[columns]).assign(length=length),
+                schema=writer.schema if writer else None,
+                preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(output, table.schema,
+                                          compression="zstd")
+            writer.write_table(table)
+    finally:
+        if writer:
+            writer.close()
 
 
 def calculate_trip_length(path: str, output: str) -> None:
-    temp = pd.read_pickle(path)
-    temp.to_crs(23700, inplace=True)
-    temp["length"] = temp["geometry"].length
-    temp.drop("geometry", axis=1, inplace=True)
+    # the reprojection returns a new frame, the loaded one is discarded
+    temp = pd.read_pickle(path).to_crs(23700)
+    temp["length"] = beeline_length(temp["geometry"])
+    temp = temp.drop(columns="geometry")
 
     temp.to_csv(output, index=False)
 